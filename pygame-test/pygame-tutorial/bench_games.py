@@ -0,0 +1,341 @@
+'''Headless frame-timing benchmarks for the tutorial games.
+
+Each game is run for a fixed number of frames under SDL's dummy video and
+audio drivers with scripted input in place of the keyboard and mouse and a
+fixed frame time in place of the clock. The time spent loading, updating,
+drawing and flipping is reported as JSON. A game that ends before all the
+frames have run (the scripted player dies, say) is started again, so every
+game does the same amount of work; how many times that happened is reported
+along with the frames run:
+
+    python bench_games.py [--frames N] [--dt MS] [--game NAME ...] [-o FILE]
+'''
+import os
+
+# these must be set before pygame is initialised
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+import sys
+import imp
+import json
+import time
+import argparse
+
+import pygame
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PHASES = ['load', 'update', 'draw', 'flip']
+
+
+class Finished(Exception):
+    '''Raised from the last frame's flip to stop the game mid-loop.'''
+
+
+class Keys(object):
+    '''Stands in for the result of pygame.key.get_pressed().'''
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return int(key in self.held)
+
+    def __len__(self):
+        return 512
+
+
+class Clock(object):
+    '''Stands in for pygame.time.Clock, always reporting the same frame time.
+    '''
+    dt = 33
+
+    def tick(self, framerate=0):
+        return self.dt
+
+    def get_time(self):
+        return self.dt
+
+    def get_fps(self):
+        return 1000. / self.dt
+
+
+class Run(object):
+    '''Runs one game, replacing the parts of pygame that would make it
+    interactive or real-time and timing the phases of each frame.
+
+    The script is called with the frame number at the start of each frame
+    and returns the set of keys held down and a list of events to post for
+    that frame.
+    '''
+    def __init__(self, frames, script):
+        self.frames = frames
+        self.script = script
+        self.frame = 0
+        # the number of times the game ended and was started again
+        self.restarts = 0
+        self.times = dict((phase, 0.) for phase in PHASES)
+        self.start = time.time()
+        self.frame_start = None
+        self.timing = None
+        self.held = set()
+        self.patched = []
+
+    def patch(self, obj, name, replacement):
+        # remember whether the attribute was inherited so restoring it doesn't
+        # leave a copy behind on a subclass
+        self.patched.append((obj, name, obj.__dict__.get(name)))
+        setattr(obj, name, replacement)
+
+    def restore(self):
+        for obj, name, original in reversed(self.patched):
+            if original is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self.patched = []
+
+    def timed(self, obj, name, phase):
+        '''Add the time spent in obj.name to the phase (ignoring any timed
+        calls it makes in turn.)
+        '''
+        original = getattr(obj, name)
+        run = self
+
+        def wrapper(*args, **kw):
+            run.begin_frame()
+            if run.timing is not None:
+                return original(*args, **kw)
+            run.timing = phase
+            t = time.time()
+            try:
+                return original(*args, **kw)
+            finally:
+                run.times[phase] += time.time() - t
+                run.timing = None
+                if phase == 'flip':
+                    run.end_frame()
+        self.patch(obj, name, wrapper)
+
+    def begin_frame(self):
+        if self.frame_start is not None:
+            return
+        now = time.time()
+        if self.frame == 0:
+            # everything up to the first frame is loading
+            self.times['load'] = now - self.start
+        self.frame_start = now
+        self.held, events = self.script(self.frame)
+        for event in events:
+            pygame.event.post(event)
+
+    def end_frame(self):
+        self.frame_start = None
+        self.frame += 1
+        if self.frame == self.frames:
+            raise Finished()
+
+    def play(self, start):
+        '''Call start() to play the game, starting it again each time it
+        ends until all the frames have run.'''
+        while True:
+            frame = self.frame
+            start()
+            if self.frame == frame:
+                raise RuntimeError('the game ended without running a frame')
+            self.restarts += 1
+
+    def get_pressed(self):
+        self.begin_frame()
+        return Keys(self.held)
+
+    def __enter__(self):
+        self.patch(pygame.key, 'get_pressed', self.get_pressed)
+        self.patch(pygame.time, 'Clock', Clock)
+        self.timed(pygame.display, 'flip', 'flip')
+        self.timed(pygame.display, 'update', 'flip')
+        return self
+
+    def __exit__(self, *exc):
+        self.restore()
+        self.total = time.time() - self.start
+        return exc[0] is Finished
+
+    def report(self):
+        r = dict(frames=self.frame, restarts=self.restarts,
+            total_ms=self.total * 1000)
+        for phase in PHASES:
+            r[phase + '_ms'] = self.times[phase] * 1000
+            if phase != 'load' and self.frame:
+                r[phase + '_ms_per_frame'] = (self.times[phase] * 1000 /
+                    self.frame)
+        return r
+
+
+def keydown(key):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode=u'')
+
+
+def mouse(type, pos):
+    if type == pygame.MOUSEMOTION:
+        return pygame.event.Event(type, pos=pos, rel=(0, 0), buttons=(1, 0, 0))
+    return pygame.event.Event(type, pos=pos, button=1)
+
+
+def import_game(directory, filename, name):
+    os.chdir(os.path.join(HERE, directory))
+    sys.path.insert(0, os.getcwd())
+    return imp.load_source(name, filename)
+
+
+def bench_platformer(run):
+    def script(frame):
+        held = set([pygame.K_RIGHT])
+        if frame % 60 < 20:
+            held = set([pygame.K_LEFT])
+        if frame % 45 == 10:
+            held.add(pygame.K_SPACE)
+        if frame % 30 == 0:
+            held.add(pygame.K_LSHIFT)
+        return held, []
+    run.script = script
+    with run:
+        import tmx
+        platformer = import_game('.', 'platformer.py', 'platformer')
+        run.timed(tmx.TileMap, 'update', 'update')
+        run.timed(tmx.TileMap, 'draw', 'draw')
+        run.timed(tmx.TileMap, 'draw_dirty', 'draw')
+        screen = pygame.display.set_mode((640, 480))
+        run.play(lambda: platformer.Game().main(screen))
+
+
+def bench_side_scroller(run):
+    def script(frame):
+        held = set([pygame.K_UP if frame % 40 < 20 else pygame.K_DOWN])
+        if frame % 10 == 0:
+            held.add(pygame.K_LSHIFT)
+        return held, []
+    run.script = script
+    with run:
+        import tmx
+        side_scroller = import_game('.', 'side_scroller.py', 'side_scroller')
+        run.timed(tmx.TileMap, 'update', 'update')
+        run.timed(tmx.TileMap, 'draw', 'draw')
+        screen = pygame.display.set_mode((640, 480))
+        run.play(lambda: side_scroller.Game().main(screen))
+
+
+def bench_driving(run):
+    def script(frame):
+        held = set([pygame.K_UP])
+        if frame % 50 < 25:
+            held.add(pygame.K_LEFT)
+        return held, []
+    run.script = script
+    with run:
+        import tmx
+        driving = import_game('.', 'driving.py', 'driving')
+        run.timed(tmx.TileMap, 'update', 'update')
+        run.timed(tmx.TileMap, 'draw', 'draw')
+        run.play(driving.main)
+
+
+def bench_flappy(run):
+    def script(frame):
+        if frame % 12 == 0:
+            return set(), [keydown(pygame.K_SPACE)]
+        return set(), []
+    run.script = script
+    with run:
+        flappy = import_game('flappy', 'flappy.py', 'flappy')
+        run.timed(flappy.PipesGroup, 'update', 'update')
+        run.timed(flappy.GroundGroup, 'update', 'update')
+        run.timed(flappy.ScrolledGroup, 'draw', 'draw')
+        run.timed(flappy.Bird, 'draw', 'draw')
+        run.play(flappy.play)
+
+
+def bench_match3(run):
+    game = []
+
+    def script(frame):
+        # every half second drag a shape to a neighbouring cell
+        if not game or not frame or frame % 15:
+            return set(), []
+        if not hasattr(game[0], 'play_x_offset'):
+            return set(), []
+        g = game[0]
+        n = frame // 15
+        x, y = (n * 3) % 7, (n * 5) % 8
+        start = (g.play_x_offset + x * g.icon_size + g.icon_size // 2,
+            g.play_y_offset + y * g.icon_size + g.icon_size // 2)
+        end = (start[0] + g.icon_size, start[1])
+        return set(), [mouse(pygame.MOUSEBUTTONDOWN, start),
+            mouse(pygame.MOUSEMOTION, end), mouse(pygame.MOUSEBUTTONUP, end)]
+    run.script = script
+    with run:
+        match3 = import_game('match3', 'main.py', 'match3')
+        run.timed(match3.Game, 'update', 'update')
+        run.timed(match3.ColumnGroup, 'draw', 'draw')
+        pygame.init()
+        screen = pygame.display.set_mode((480, 800))
+        g = match3.Game(screen, 'mdpi', 1, 48)
+        # don't touch any real saved game and skip the about screen
+        g.save_fn = os.path.join(HERE, 'bench-match3.save')
+        g.splash_shown = True
+        game.append(g)
+        try:
+            g.main()
+        finally:
+            if os.path.exists(g.save_fn):
+                os.remove(g.save_fn)
+
+
+GAMES = [
+    ('platformer', bench_platformer),
+    ('side_scroller', bench_side_scroller),
+    ('driving', bench_driving),
+    ('flappy', bench_flappy),
+    ('match3', bench_match3),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=300,
+        help='number of frames to run each game for')
+    parser.add_argument('--dt', type=int, default=33,
+        help='fixed frame time in milliseconds')
+    parser.add_argument('--game', action='append', choices=dict(GAMES),
+        help='game to run (may be repeated; default all)')
+    parser.add_argument('-o', '--output', help='write the JSON to this file')
+    args = parser.parse_args()
+
+    Clock.dt = args.dt
+    pygame.init()
+    # the games print their outcome; keep that out of the JSON
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    results = {}
+    for name, bench in GAMES:
+        if args.game and name not in args.game:
+            continue
+        run = Run(args.frames, None)
+        try:
+            bench(run)
+        except Exception as e:
+            results[name] = dict(error='%s: %s' % (e.__class__.__name__, e))
+        else:
+            results[name] = run.report()
+        finally:
+            os.chdir(HERE)
+            del sys.path[0]
+    sys.stdout = stdout
+    results = json.dumps(dict(frames=args.frames, dt_ms=args.dt,
+        games=results), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+'''Microbenchmarks for the tmx module.
+
+Run with the size of the generated map as an optional argument:
+
+    python bench_tmx.py [size]
+
+A size x size cell map is generated in memory with a handful of "trigger"
+tiles scattered around it so no TMX file is needed.
+'''
+import sys
+import random
+import timeit
+
+import pygame
+import tmx
+
+
+def generate_map(size, seed=1):
+    '''Generate a TileMap with a single size x size Layer called "map".
+
+    Most cells are plain ground tiles; about one in a thousand has a tile
+    with a "player", "enemy" or "exit" property.
+    '''
+    rand = random.Random(seed)
+    tilemap = tmx.TileMap((640, 480))
+    tilemap.width = tilemap.height = size
+    tilemap.tile_width = tilemap.tile_height = 32
+    tilemap.px_width = tilemap.px_height = size * 32
+
+    tileset = tmx.Tileset('generated', 32, 32, 1)
+    surface = pygame.Surface((32, 32))
+    for gid, name in enumerate(['ground', 'player', 'enemy', 'exit'], 1):
+        tile = tmx.Tile(gid, surface, tileset)
+        if name != 'ground':
+            tile.properties[name] = 'yes'
+        tileset.tiles.append(tile)
+    tilemap.tilesets.add(tileset)
+
+    layer = tmx.Layer('map', 1, tilemap)
+    for n in range(size * size):
+        if rand.random() < .001:
+            layer.gids[n] = rand.choice([2, 3, 4])
+        else:
+            layer.gids[n] = 1
+    tilemap.layers.add_named(layer, layer.name)
+    return tilemap
+
+
+def bench(label, fn, number):
+    t = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print '%-40s %10.3f ms' % (label, t * 1000)
+
+
+def main(size=1000):
+    layer = generate_map(size).layers['map']
+    print 'map %dx%d, %d enemies' % (size, size, len(layer.find('enemy')))
+
+    def scan():
+        return [cell for cell in layer.iter_cells() if 'enemy' in cell]
+    bench('find by scanning every cell', scan, 1)
+
+    def build():
+        layer.build_index()
+    bench('build property index', build, 1)
+
+    bench('find("enemy") with index', lambda: layer.find('enemy'), 100)
+    bench('match(enemy="yes") with index',
+        lambda: layer.match(enemy='yes'), 100)
+
+    # a frame's worth of sprite collision tests
+    rand = random.Random(2)
+    rects = [pygame.Rect(rand.randrange(size * 32), rand.randrange(size * 32),
+        32, 32) for n in range(1000)]
+    print '%d rects, numpy %s' % (len(rects),
+        'available' if tmx.numpy else 'not available')
+
+    def collide_each():
+        return [layer.collide(rect, 'enemy') for rect in rects]
+    bench('collide() for each rect', collide_each, 10)
+
+    if tmx.numpy:
+        # build the mask outside of the timing
+        layer.get_mask('enemy')
+    bench('collide_many()', lambda: layer.collide_many(rects, 'enemy'), 10)
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
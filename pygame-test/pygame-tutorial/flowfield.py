@@ -0,0 +1,262 @@
+'''A shared flow field for finding the way across a grid of cells.
+
+Rather than each creep searching for the exit every time it reaches a cell,
+the distance from every cell to the nearest exit is worked out once with a
+breadth-first search out from the exits. A creep then just steps to the
+neighbouring cell that is one step closer.
+
+When a cell becomes blocked (a tower is built on it) only the cells whose way
+out went through it need to find a new way, so those are repaired rather
+than searching the whole grid again.
+
+Before blocking a cell it's worth knowing whether that would leave the
+creeps with no way out at all. The cells which would are the "cut" cells
+(articulation points) between the sources (entrances) and the exits, which
+are all found with one depth-first search and then looked up as needed.
+
+Cells are addressed (i, j) like the cocos RectMapLayer cells: i is the
+column and j the row. This module has no dependencies so it may be used
+without cocos (or a screen) at all.
+'''
+import heapq
+from array import array
+
+UNREACHABLE = -1
+
+
+class FlowField(object):
+    def __init__(self, width, height, blocked, exits, sources=()):
+        '''blocked and exits are the (i, j) cells which may not be entered
+        and the cells the creeps are heading for; sources are the cells they
+        start from, which must never be cut off from the exits.
+        '''
+        self.width = width
+        self.height = height
+        # the cells are stored at index i * height + j
+        self.passable = bytearray([1]) * (width * height)
+        for i, j in blocked:
+            self.passable[i * height + j] = 0
+        self.exits = [i * height + j for i, j in exits]
+        self.sources = [i * height + j for i, j in sources]
+
+        # the cells next to each cell, in the order they're tried
+        self.neighbours = []
+        for n in range(width * height):
+            i, j = divmod(n, height)
+            self.neighbours.append([a * height + b
+                for a, b in ((i, j+1), (i, j-1), (i-1, j), (i+1, j))
+                if 0 <= a < width and 0 <= b < height])
+
+        # steps to the nearest exit and the index of the cell to step to
+        # from each cell (both UNREACHABLE if there's no way out)
+        self.distance = array('i', [UNREACHABLE]) * (width * height)
+        self.next = array('i', [UNREACHABLE]) * (width * height)
+        self.rebuild()
+
+        # the results of the cut cell search (None until it's needed)
+        self.cuts = None
+
+    def rebuild(self):
+        '''Work out the whole field from scratch.'''
+        distance = self.distance
+        for n in range(len(distance)):
+            distance[n] = UNREACHABLE
+        queue = []
+        for n in self.exits:
+            if self.passable[n]:
+                distance[n] = 0
+                queue.append(n)
+        # the queue list is extended as we go, so this visits every cell
+        # reachable from an exit, nearest first
+        for here in queue:
+            d = distance[here] + 1
+            for n in self.neighbours[here]:
+                if distance[n] == UNREACHABLE and self.passable[n]:
+                    distance[n] = d
+                    queue.append(n)
+        for n in range(len(distance)):
+            self.next[n] = self.downhill(n)
+
+    def downhill(self, n):
+        '''Find the first neighbour of cell n that's one step closer to an
+        exit.
+        '''
+        d = self.distance[n]
+        if d <= 0:
+            return UNREACHABLE
+        for m in self.neighbours[n]:
+            if self.distance[m] == d - 1:
+                return m
+        return UNREACHABLE
+
+    def block(self, i, j):
+        '''Mark the cell (i, j) as impassable and repair the field.
+
+        Blocking a cell can only make the way out longer (or impossible) for
+        the cells whose way out went through it; everything else keeps its
+        distance and next step.
+        '''
+        cell = i * self.height + j
+        if not self.passable[cell]:
+            return
+        self.passable[cell] = 0
+        distance = self.distance
+        if distance[cell] == UNREACHABLE:
+            # nothing could get to the exit through here anyway
+            return
+        self.cuts = None
+
+        # find all the cells whose way out goes through the blocked one
+        affected = [cell]
+        seen = set(affected)
+        for here in affected:
+            for n in self.neighbours[here]:
+                if self.next[n] == here and n not in seen:
+                    seen.add(n)
+                    affected.append(n)
+        for n in affected:
+            distance[n] = UNREACHABLE
+            self.next[n] = UNREACHABLE
+
+        # those cells next to an unaffected cell may go that way; from there
+        # spread out through the affected cells, nearest to an exit first
+        queue = []
+        for n in affected:
+            if not self.passable[n]:
+                continue
+            best = min([distance[m] for m in self.neighbours[n]
+                if distance[m] != UNREACHABLE and m not in seen] or [None])
+            if best is not None:
+                queue.append((best + 1, n))
+        heapq.heapify(queue)
+        while queue:
+            d, here = heapq.heappop(queue)
+            if distance[here] != UNREACHABLE:
+                continue
+            distance[here] = d
+            for n in self.neighbours[here]:
+                if n in seen and distance[n] == UNREACHABLE and \
+                        self.passable[n]:
+                    heapq.heappush(queue, (d + 1, n))
+        for n in affected:
+            self.next[n] = self.downhill(n)
+
+    def next_cell(self, i, j):
+        '''Return the (i, j) cell to step to from (i, j) to get closer to an
+        exit, or None if (i, j) is an exit.
+
+        Raises ValueError if there's no way to an exit.
+        '''
+        here = i * self.height + j
+        distance = self.distance
+        if self.passable[here]:
+            if distance[here] == 0:
+                return None
+            n = self.next[here]
+        else:
+            # something was built where we're standing; just get out of it
+            ways = [m for m in self.neighbours[here]
+                if distance[m] != UNREACHABLE]
+            n = min(ways, key=distance.__getitem__) if ways else UNREACHABLE
+        if n == UNREACHABLE:
+            raise ValueError("Can't solve map")
+        return divmod(n, self.height)
+
+    def find_cuts(self):
+        '''Find the cells which, if blocked, would cut a source off from
+        every exit.
+
+        This is a depth-first search out from the exits (as though they were
+        all joined to one extra cell) keeping track of how far back up the
+        search each cell can get without going back the way it came. If none
+        of the cells found through a neighbour of cell c can get back above c
+        then c is the only way out for them, and if any of them is a source
+        c mustn't be blocked. The order cells were found in (and when we
+        were done with them) is kept so we can also tell which cells are
+        cut off by any cell; see separates().
+        '''
+        size = self.width * self.height
+        passable = self.passable
+        neighbours = self.neighbours
+        # when each cell was found (from 1; 0 is the joined exits), when its
+        # search finished, the earliest found cell it gets back to and the
+        # cell it was found from
+        found = array('i', [0]) * size
+        done = array('i', [0]) * size
+        low = array('i', [0]) * size
+        parent = array('i', [UNREACHABLE]) * size
+        # whether there's a source among the cells found from each cell
+        reaches = bytearray(size)
+        for n in self.sources:
+            reaches[n] = 1
+        cuts = bytearray(size)
+        exits = set(self.exits)
+
+        count = 0
+        for root in self.exits:
+            if not passable[root] or found[root]:
+                continue
+            count += 1
+            found[root] = count
+            stack = [(root, iter(neighbours[root]))]
+            while stack:
+                here, todo = stack[-1]
+                for n in todo:
+                    if not passable[n] or n == parent[here]:
+                        continue
+                    if found[n]:
+                        low[here] = min(low[here], found[n])
+                        continue
+                    count += 1
+                    found[n] = count
+                    # the exits (all being joined) get back to the very start
+                    low[n] = 0 if n in exits else count
+                    parent[n] = here
+                    stack.append((n, iter(neighbours[n])))
+                    break
+                else:
+                    # all done with this cell
+                    stack.pop()
+                    count += 1
+                    done[here] = count
+                    up = parent[here]
+                    if up == UNREACHABLE:
+                        continue
+                    low[up] = min(low[up], low[here])
+                    if reaches[here]:
+                        reaches[up] = 1
+                        if low[here] >= found[up]:
+                            cuts[up] = 1
+        self.cuts = cuts
+        self.found = found
+        self.done = done
+        self.low = low
+        self.parent = parent
+
+    def would_disconnect(self, i, j, others=()):
+        '''Would blocking cell (i, j) cut a source, or any of the other
+        (i, j) cells, off from every exit?'''
+        if self.cuts is None:
+            self.find_cuts()
+        cell = i * self.height + j
+        if self.cuts[cell]:
+            return True
+        for oi, oj in others:
+            if self.separates(cell, oi * self.height + oj):
+                return True
+        return False
+
+    def separates(self, cell, other):
+        '''Is cell the only way out for cell other (both indexes)?'''
+        found = self.found
+        if cell == other or not found[cell] or not found[other]:
+            return False
+        # other must have been found from one of cell's neighbours which
+        # can't get back above cell
+        if not found[cell] < found[other] < self.done[cell]:
+            return False
+        for n in self.neighbours[cell]:
+            if self.parent[n] == cell and \
+                    found[n] <= found[other] < self.done[n]:
+                return self.low[n] >= found[cell]
+        return False
@@ -0,0 +1,81 @@
+'''Benchmark the match 3 block columns with big cascades.
+
+Every frame a lot of blocks (by default half the grid) are removed from the
+columns at random and the columns are refilled and updated, which is the
+worst case for keeping the columns in order:
+
+    python bench_columns.py [--frames N] [--clear N] [--seed N]
+'''
+import time
+import random
+import argparse
+
+import pygame
+
+import main as match3
+from board import Board, SIZE
+
+ICON_SIZE = 48
+
+
+def setup():
+    # plain images will do; nothing gets drawn
+    for shape in match3.SHAPES:
+        match3.IMAGES[shape] = pygame.Surface((ICON_SIZE, ICON_SIZE))
+    board = Board(match3.SHAPES)
+    columns = []
+    for n in range(SIZE):
+        column = match3.ColumnGroup()
+        column.x = n * ICON_SIZE
+        column.index = n
+        column.board = board
+        columns.append(column)
+    return board, columns
+
+
+def fill(columns):
+    for column in columns:
+        while len(column) < SIZE:
+            match3.Block(0, column)
+
+
+def bench(frames, clear, seed):
+    random.seed(seed)
+    board, columns = setup()
+    fill(columns)
+    cells = [(x, y) for x in range(SIZE) for y in range(SIZE)]
+    removed = 0
+    elapsed = 0
+    for frame in range(frames):
+        # pick the blocks first, just as find_matches does
+        sprites = [columns[x]._column_order[SIZE - 1 - y]
+            for x, y in random.sample(cells, clear)]
+        start = time.time()
+        for sprite in sprites:
+            sprite.kill()
+        for column in columns:
+            column.compact()
+        fill(columns)
+        for column in columns:
+            column.update(1 / 30.)
+        elapsed += time.time() - start
+        removed += clear
+    return elapsed, removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--clear', type=int, default=SIZE * SIZE // 2,
+        help='number of blocks to remove each frame')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    elapsed, removed = bench(args.frames, args.clear, args.seed)
+    print '%d frames, %d blocks removed in %.3fs' % (args.frames, removed,
+        elapsed)
+    print '%.1f usec per frame, %.2f usec per block removed' % (
+        elapsed / args.frames * 1e6, elapsed / removed * 1e6)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+'''The match 3 play area as an 8x8 array of shape ids.
+
+The blocks on screen are sprites stacked up in columns; this keeps a copy of
+just their shapes as small integers so the rules of the game may be checked
+without touching (or even having) any sprites. Cells are addressed (x, y) with
+y counting down from the top row. Like the sprite columns each column here is
+a stack: blocks are pushed on to the top and removing a block drops all of
+the blocks above it down by one.
+
+Every cell whose contents change is remembered, so looking for matches only
+needs to look at the groups those cells are part of: any group not touching a
+changed cell was already there (and already removed) the last time we looked.
+
+The same goes for the legal moves (swaps of neighbouring blocks which make a
+group.) Whether a swap is legal only depends on the cells within two steps of
+it, so only the swaps near changed cells are checked again.
+'''
+from array import array
+
+SHAPES = set('point star box circle spiral diamond triangle'.split())
+SIZE = 8
+EMPTY = -1
+
+# internally cell (x, y) is stored at index x * SIZE + y; these are the
+# indexes of the cells next to each cell
+NEIGHBOURS = []
+for i in range(SIZE * SIZE):
+    x, y = divmod(i, SIZE)
+    NEIGHBOURS.append([nx * SIZE + ny
+        for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1))
+        if 0 <= nx < SIZE and 0 <= ny < SIZE])
+
+# every possible swap as a pair of indexes (lowest first) and the swaps which
+# have to be checked again when each cell changes
+SWAPS = [(i, j) for i in range(SIZE * SIZE) for j in NEIGHBOURS[i] if i < j]
+NEARBY_SWAPS = [[] for i in range(SIZE * SIZE)]
+for i, j in SWAPS:
+    for n in range(SIZE * SIZE):
+        x, y = divmod(n, SIZE)
+        if min(abs(x - c // SIZE) + abs(y - c % SIZE) for c in (i, j)) <= 2:
+            NEARBY_SWAPS[n].append((i, j))
+
+
+class Board(object):
+    def __init__(self, shapes):
+        # shapes are stored as their index into this list
+        self.shapes = sorted(shapes)
+        self.ids = dict((shape, n) for n, shape in enumerate(self.shapes))
+        self.cells = array('b', [EMPTY] * (SIZE * SIZE))
+        # number of blocks stacked in each column
+        self.heights = [0] * SIZE
+        # the cells changed since the last find_groups(clear=True)
+        self.dirty = set()
+        # the legal swaps (as index pairs) and the indexes of the cells
+        # changed since they were last brought up to date
+        self.moves = set()
+        self.stale = set()
+
+    def __getitem__(self, pos):
+        x, y = pos
+        return self.cells[x * SIZE + y]
+
+    def shape(self, x, y):
+        '''Return the name of the shape at (x, y) or None if it's empty.'''
+        shape = self.cells[x * SIZE + y]
+        if shape == EMPTY:
+            return None
+        return self.shapes[shape]
+
+    def neighbour_shapes(self, x):
+        '''Return the shapes next to the cell the next block pushed on to
+        column x will end up in.
+        '''
+        h = self.heights[x]
+        y = SIZE - 1 - h
+        shapes = set()
+        if h:
+            shapes.add(self.shape(x, y + 1))
+        for n in x - 1, x + 1:
+            if 0 <= n < SIZE and self.heights[n] > h:
+                shapes.add(self.shape(n, y))
+        return shapes
+
+    def push(self, x, shape):
+        '''Add a block with the named shape to the top of column x.'''
+        h = self.heights[x]
+        if h == SIZE:
+            raise ValueError('column %d is full' % x)
+        y = SIZE - 1 - h
+        self.cells[x * SIZE + y] = self.ids[shape]
+        self.heights[x] = h + 1
+        self.dirty.add((x, y))
+        self.stale.add(x * SIZE + y)
+
+    def remove(self, x, *positions):
+        '''Remove the blocks at the given positions (counting up from the
+        bottom) of column x.
+
+        Every block above the lowest one removed drops down and so all of
+        those cells are now dirty.
+        '''
+        cells = self.cells
+        base = x * SIZE
+        top = SIZE - self.heights[x]
+        y = SIZE - 1 - min(positions)
+        # the cells holding blocks to be removed
+        gone = set(SIZE - 1 - k for k in positions)
+        # walk up the column from the lowest removed block, moving the blocks
+        # we keep down into place
+        dest = y
+        for i in range(y, top - 1, -1):
+            if i not in gone:
+                cells[base + dest] = cells[base + i]
+                dest -= 1
+        for i in range(top, dest + 1):
+            cells[base + i] = EMPTY
+        self.heights[x] -= len(gone)
+        for i in range(top, y + 1):
+            self.dirty.add((x, i))
+            self.stale.add(base + i)
+
+    def clear(self):
+        for i in range(SIZE * SIZE):
+            self.cells[i] = EMPTY
+        self.heights = [0] * SIZE
+        self.dirty.clear()
+        self.moves.clear()
+        self.stale.clear()
+
+    def swap(self, a, b):
+        '''Swap the blocks in cells a and b.'''
+        i = a[0] * SIZE + a[1]
+        j = b[0] * SIZE + b[1]
+        cells = self.cells
+        cells[i], cells[j] = cells[j], cells[i]
+        self.dirty.add(a)
+        self.dirty.add(b)
+        self.stale.add(i)
+        self.stale.add(j)
+
+    def group(self, x, y, heights=None):
+        '''Find all the cells connected to (x, y) holding the same shape.
+
+        Only the bottom heights[x] cells of each column are considered, which
+        allows blocks still falling into place to be ignored.
+        '''
+        if heights is None:
+            heights = self.heights
+        cells = self.cells
+        shape = cells[x * SIZE + y]
+        if shape == EMPTY or y < SIZE - heights[x]:
+            return []
+        group = [(x, y)]
+        seen = set(group)
+        # the group list is extended as we go, so this visits every cell that
+        # gets added to it
+        for x, y in group:
+            for nx, ny in (x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1):
+                if not 0 <= nx < SIZE or not SIZE - heights[nx] <= ny < SIZE:
+                    continue
+                if (nx, ny) in seen or cells[nx * SIZE + ny] != shape:
+                    continue
+                seen.add((nx, ny))
+                group.append((nx, ny))
+        return group
+
+    def find_groups(self, clear=False):
+        '''Find the groups of three or more connected same-shaped blocks which
+        include a changed cell, in the order the game removes them.
+
+        The game scans the board from the top left a column at a time and
+        moves on to the next column as soon as it finds a group, so a group
+        only found further down that column is left for the next pass. Since
+        the score depends on the order the groups are removed in we do the
+        same; each group is a list of cells. If clear is true the changed
+        cells are forgotten, apart from those in groups left for next time.
+        '''
+        # which group of three or more (if any) each cell we look at is in
+        owner = {}
+        for cell in self.dirty:
+            if cell in owner:
+                continue
+            group = self.group(*cell) or [cell]
+            found = group if len(group) > 2 else None
+            for other in group:
+                owner[other] = found
+
+        groups = []
+        taken = set()
+        columns = set()
+        for cell in sorted(cell for cell in owner if owner[cell] is not None):
+            group = owner[cell]
+            if cell[0] in columns or id(group) in taken:
+                continue
+            groups.append(group)
+            taken.add(id(group))
+            columns.add(cell[0])
+
+        if clear:
+            self.dirty = set(cell for cell in owner
+                if owner[cell] is not None and id(owner[cell]) not in taken)
+        return groups
+
+    def in_group(self, i):
+        '''Is the block at index i part of a group of three or more?
+
+        It is if two of its neighbours have the same shape, or if one does and
+        that has another neighbour with the same shape.
+        '''
+        cells = self.cells
+        shape = cells[i]
+        if shape == EMPTY:
+            return False
+        matching = [n for n in NEIGHBOURS[i] if cells[n] == shape]
+        if len(matching) != 1:
+            return len(matching) > 1
+        for n in NEIGHBOURS[matching[0]]:
+            if n != i and cells[n] == shape:
+                return True
+        return False
+
+    def is_legal(self, i, j):
+        '''Would swapping the blocks at indexes i and j make a group?'''
+        cells = self.cells
+        if cells[i] == cells[j]:
+            return False
+        cells[i], cells[j] = cells[j], cells[i]
+        legal = self.in_group(i) or self.in_group(j)
+        cells[i], cells[j] = cells[j], cells[i]
+        return legal
+
+    def update_moves(self):
+        '''Bring the set of legal moves up to date with the changed cells.'''
+        if not self.stale:
+            return
+        if len(self.stale) > SIZE * 2:
+            swaps = SWAPS
+        else:
+            swaps = set()
+            for i in self.stale:
+                swaps.update(NEARBY_SWAPS[i])
+        self.stale.clear()
+        for swap in swaps:
+            if self.is_legal(*swap):
+                self.moves.add(swap)
+            else:
+                self.moves.discard(swap)
+
+    def move_count(self):
+        '''Return the number of swaps which would make a group.'''
+        self.update_moves()
+        return len(self.moves)
+
+    def legal_moves(self):
+        '''Return all the legal moves as pairs of (x, y) cells.'''
+        self.update_moves()
+        return [(divmod(i, SIZE), divmod(j, SIZE)) for i, j in sorted(self.moves)]
+
+    def hint(self):
+        '''Return a legal move as a pair of (x, y) cells, or None if there
+        are no moves left.
+        '''
+        self.update_moves()
+        if not self.moves:
+            return None
+        i, j = min(self.moves)
+        return divmod(i, SIZE), divmod(j, SIZE)
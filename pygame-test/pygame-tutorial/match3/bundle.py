@@ -0,0 +1,139 @@
+'''Pack the match 3 images into texture atlases.
+
+Starting the game used to mean loading a PNG for every shape, the cross and
+each of the action icons, and then working out which font size fits the
+action icons by loading the font over and over at bigger and bigger sizes.
+On a phone all of that adds up. Running this module (after gen_png.sh has made
+the PNGs, and before gen_exe.py or building for android) packs:
+
+    data/shapes-<icon size>.png   the shapes and cross at that icon size
+    data/actions-<density>.png    the action icons for that screen density
+    data/bundle.idx               where each image is in those atlases and
+                                  the font size to use for each density
+
+so the game only has to load the index and two images. If there's no bundle
+(or it doesn't cover the icon size or density) the game loads the separate
+files as it always did.
+
+    python bundle.py [DATADIR]
+'''
+import os
+import sys
+import glob
+import marshal
+
+import pygame
+
+from board import SHAPES
+
+ACTIONS = '''1_navigation_accept 1_navigation_cancel 1_navigation_refresh
+    2_action_about 2_action_help'''.split()
+
+# the size of the action icons (in pixels) for each screen density
+ACTION_ICON_SIZES = dict(ldpi=18, mdpi=32, hdpi=36, xhdpi=48)
+
+INDEX = 'bundle.idx'
+VERSION = 1
+
+
+def font_size(filename, target):
+    '''Find the smallest size for the font to render lines at least target
+    pixels high.
+    '''
+    size = 8
+    while pygame.font.Font(filename, size).get_linesize() < target:
+        size += 1
+    return size
+
+
+def pack_atlas(images, filename):
+    '''Lay out the named images in a row, save them as one image and return
+    the rect each image ended up at.
+    '''
+    names = sorted(images)
+    w = sum(images[name].get_width() for name in names)
+    h = max(images[name].get_height() for name in names)
+    atlas = pygame.Surface((w, h), pygame.SRCALPHA, 32)
+    rects = {}
+    x = 0
+    for name in names:
+        image = images[name]
+        # the images don't overlap so just copy them in, alpha and all
+        atlas.blit(image, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+        rects[name] = (x, 0) + image.get_size()
+        x += image.get_width()
+    pygame.image.save(atlas, filename)
+    return rects
+
+
+def pack(datadir):
+    '''Build the atlases and index in datadir from the separate images.'''
+    index = dict(version=VERSION, shapes={}, actions={}, fonts={})
+
+    names = sorted(SHAPES) + ['cross']
+    sizes = set()
+    for filename in glob.glob(os.path.join(datadir, 'cross-*.png')):
+        sizes.add(int(filename.rsplit('-', 1)[1][:-4]))
+    for size in sorted(sizes):
+        filenames = dict((name, os.path.join(datadir, '%s-%s.png' % (name,
+            size))) for name in names)
+        missing = [fn for fn in filenames.values() if not os.path.exists(fn)]
+        if missing:
+            print 'skipping icon size %d, missing %s' % (size,
+                ', '.join(missing))
+            continue
+        images = dict((name, pygame.image.load(fn))
+            for name, fn in filenames.items())
+        atlas = 'shapes-%d.png' % size
+        index['shapes'][size] = (atlas,
+            pack_atlas(images, os.path.join(datadir, atlas)))
+        print 'packed %s' % atlas
+
+    for density in sorted(ACTION_ICON_SIZES):
+        images = dict((name, pygame.image.load(os.path.join(datadir, density,
+            name + '.png'))) for name in ACTIONS)
+        atlas = 'actions-%s.png' % density
+        index['actions'][density] = (atlas,
+            pack_atlas(images, os.path.join(datadir, atlas)))
+        index['fonts'][density] = font_size(os.path.join(datadir,
+            'Roboto-Regular.ttf'), ACTION_ICON_SIZES[density])
+        print 'packed %s, font size %d' % (atlas, index['fonts'][density])
+
+    with open(os.path.join(datadir, INDEX), 'wb') as f:
+        marshal.dump(index, f)
+
+
+class Bundle(object):
+    '''The packed images and font size for one icon size and density.'''
+    def __init__(self, images, font_size):
+        self.images = images
+        self.font_size = font_size
+
+
+def load(datadir, icon_size, density):
+    '''Load the bundle for the icon size and screen density, or return None
+    if there isn't one.
+    '''
+    try:
+        with open(os.path.join(datadir, INDEX), 'rb') as f:
+            index = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(index, dict) or index.get('version') != VERSION:
+        return None
+    if icon_size not in index['shapes'] or density not in index['actions']:
+        return None
+
+    images = {}
+    for atlas, rects in (index['shapes'][icon_size],
+            index['actions'][density]):
+        # the images share the atlas' pixels rather than being copied out
+        atlas = pygame.image.load(os.path.join(datadir, atlas))
+        for name, rect in rects.items():
+            images[name] = atlas.subsurface(rect)
+    return Bundle(images, index['fonts'][density])
+
+
+if __name__ == '__main__':
+    pygame.init()
+    pack(sys.argv[1] if len(sys.argv) > 1 else 'data')
@@ -15,3 +15,6 @@ done
 ${INKSCAPE} android-icon.svg -w 48 -e android-icon.png
 ${INKSCAPE} android-presplash -w 128 -e android-presplash.png
 convert android-presplash.png android-presplash.jpg
+
+# pack the images into atlases for quicker loading
+python bundle.py
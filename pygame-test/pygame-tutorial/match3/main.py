@@ -9,12 +9,16 @@ TODO
 import os
 import sys
 import random
-import marshal
 import webbrowser
-import platform
+from array import array
 
 import pygame
 
+import bundle
+from board import Board, SHAPES, SIZE
+from savefile import SaveFile
+from textcache import TextCache
+
 # Import the android module. If we can't import it, set it to None - this
 # lets us test it, and check to see if we want android-specific behavior.
 try:
@@ -24,9 +28,6 @@ except ImportError:
     android = None
     # from pygame import mixer
 
-SHAPES = set('point star box circle spiral diamond triangle'.split())
-ACTIONS = '''1_navigation_accept 1_navigation_cancel 1_navigation_refresh
-    2_action_about 2_action_help'''.split()
 IMAGES = {}
 
 # define where we can find the data files - this might change depending on the
@@ -38,22 +39,127 @@ if getattr(sys, '_MEIPASS', None):
     DATADIR = os.path.join(sys._MEIPASS, 'data', '')
 
 class ColumnGroup(pygame.sprite.LayeredDirty):
-    # special group that retains a list of the order that sprites are added
+    # special group that retains a list of the order that sprites are added;
+    # the shapes are mirrored in column "index" of the board, if there is one
+    board = None
+    index = None
+
+    # the blocks fall in fixed steps of this many seconds; each step they
+    # speed up by ACCELERATION pixels per step
+    STEP = 1 / 30.
+    ACCELERATION = 20 * STEP
+
     def __init__(self, *args, **kw):
         super(ColumnGroup, self).__init__(*args, **kw)
         self._column_order = []
+        self._gaps = 0
+        # the falling blocks' positions (before and after the last step) and
+        # speeds, in column order
+        self._y = array('d')
+        self._last_y = array('d')
+        self._speed = array('d')
+        # the blocks below this position in the column are all at rest
+        self._falling = 0
+        # time not yet stepped
+        self._time = 0
+
     def add_internal(self, sprite, layer=None):
         super(ColumnGroup, self).add_internal(sprite, layer=layer)
+        if self._gaps:
+            self.compact()
+        if self.board is not None:
+            self.board.push(self.index, sprite.shape)
+        # adding to the top doesn't move anything else
+        n = len(self._column_order)
+        sprite.column_order = n
+        sprite.target_y = sprite.y_offset + (7-n) * sprite.size
+        sprite.falling = sprite.rect.y != sprite.target_y
+        if not sprite.falling and self._falling == n:
+            self._falling += 1
         self._column_order.append(sprite)
-        for n, sprite in enumerate(self._column_order):
-            sprite.column_order = n
-            sprite.target_y = sprite.y_offset + (7-n) * sprite.size
+        self._y.append(sprite.rect.y)
+        self._last_y.append(sprite.rect.y)
+        self._speed.append(0)
+
     def remove_internal(self, sprite):
         super(ColumnGroup, self).remove_internal(sprite)
-        self._column_order.remove(sprite)
+        # leave a gap to be closed up by compact() so removing a bunch of
+        # sprites only moves the ones above them down once
+        self._column_order[sprite.column_order] = None
+        self._gaps += 1
+
+    def compact(self):
+        # close up any gaps left by removed sprites; this must be done before
+        # the column order (or the board) is used again
+        if not self._gaps:
+            return
+        order = self._column_order
+        if self.board is not None:
+            self.board.remove(self.index, *[n for n, sprite
+                in enumerate(order) if sprite is None])
+        keep = [n for n, sprite in enumerate(order) if sprite is not None]
+        self._column_order = [order[n] for n in keep]
+        self._y = array('d', [self._y[n] for n in keep])
+        self._last_y = array('d', [self._last_y[n] for n in keep])
+        self._speed = array('d', [self._speed[n] for n in keep])
+        self._gaps = 0
         for n, sprite in enumerate(self._column_order):
-            sprite.column_order = n
-            sprite.target_y = sprite.y_offset + (7-n) * sprite.size
+            if sprite.column_order != n:
+                # everything from here up has to fall
+                sprite.column_order = n
+                sprite.target_y = sprite.y_offset + (7-n) * sprite.size
+                sprite.falling = True
+                self._falling = min(self._falling, n)
+        self._falling = min(self._falling, len(self._column_order))
+
+    def update(self, dt):
+        if self._gaps:
+            self.compact()
+        order = self._column_order
+        start = self._falling
+        self._time += dt
+        steps = int(self._time / self.STEP)
+        self._time -= steps * self.STEP
+        if start == len(order):
+            # nothing's falling
+            return
+
+        # step all the falling blocks together; each rests on the bottom of
+        # the play area or the block below it
+        ys, last_ys, speeds = self._y, self._last_y, self._speed
+        for step in range(steps):
+            for n in range(self._falling, len(order)):
+                sprite = order[n]
+                if n:
+                    bottom = ys[n-1] - sprite.size
+                else:
+                    bottom = sprite.target_y
+                last_ys[n] = ys[n]
+                speeds[n] += self.ACCELERATION
+                ys[n] += speeds[n]
+                if ys[n] >= bottom:
+                    ys[n] = bottom
+                    speeds[n] = 0
+            # blocks landing in their place come to rest
+            while self._falling < len(order) and \
+                    ys[self._falling] == order[self._falling].target_y:
+                order[self._falling].falling = False
+                last_ys[self._falling] = ys[self._falling]
+                self._falling += 1
+
+        # draw the falling blocks between where they were and where they are
+        # after the last step, depending on how far through the next step we
+        # are; the ones at rest are right where they should be
+        t = self._time / self.STEP
+        for n in range(start, len(order)):
+            sprite = order[n]
+            if sprite.falling:
+                y = int(last_ys[n] + (ys[n] - last_ys[n]) * t)
+            else:
+                y = sprite.target_y
+            if y != sprite.rect.y:
+                sprite.rect.y = y
+                sprite.dirty = 1
 
 class Block(pygame.sprite.DirtySprite):
     def __init__(self, y_offset, column, prevent_shapes=set(), shape=None,
@@ -71,61 +177,15 @@ class Block(pygame.sprite.DirtySprite):
         else:
             self.target_y = y_pos
         self.rect = pygame.rect.Rect((column.x, y_pos), (self.size, self.size))
-        self.speed = 0
         super(Block, self).__init__(column)
 
     def at_rest(self):
-        return self.rect.y == self.target_y
+        # the column moves the blocks (see ColumnGroup.update)
+        return not self.falling
 
-    def update(self, dt):
-        column = self.groups()[0]
-
-        old_y = self.rect.y
-
-        if self.column_order == 0:
-            # the bottom row (first in the list) rests on the bottom of the
-            # play area
-            target_bottom = self.target_y
-        else:
-            # otherwise the rows will rest on the row below them (the row
-            # precering them in the sprite list)
-            target_bottom = column._spritelist[self.column_order-1].rect.y - self.size
-
-        # accelerate at 10 pixels per second ^ 2
-        self.speed += 20 * dt
-
-        # move down if we can until we hit target_bottom
-        self.rect.y += self.speed
-        if self.rect.y >= target_bottom:
-            self.rect.y = target_bottom
-            self.speed = 0
-
-        # if the sprite moved then it's dirty
-        if old_y != self.rect.y:
-            self.dirty = 1
-
-def find_match(sprite, grid, visited=None):
-    x, y = sprite.rect.topleft
-    if visited is None:
-        visited = set()
-    elif (x,y) in visited:
-        return []
-    visited.add((x, y))
-    r = [sprite]
-    mod = sprite.size
-    for xm, ym in (mod, 0), (-mod, 0), (0, mod), (0, -mod):
-        test = grid.get((x+xm, y+ym))
-        if test is not None and test.shape == sprite.shape:
-            r.extend(find_match(test, grid, visited))
-    return r
-
-def thousands(number):
-    s = '%d' % number
-    groups = []
-    while s and s[-1].isdigit():
-        groups.append(s[-3:])
-        s = s[:-3]
-    return s + ','.join(reversed(groups))
+    def cell(self):
+        # the (x, y) board cell this block will come to rest in
+        return self.groups()[0].index, SIZE - 1 - self.column_order
 
 class ActionSprite(pygame.sprite.Sprite):
     def __init__(self, pos, image, action, group):
@@ -154,16 +214,21 @@ class Game(object):
     MODE_HARD = 'hard'
     mode = MODE_HARD
 
+    # how often to save the game while it's being played (in seconds)
+    AUTOSAVE_INTERVAL = 5
+
     def __init__(self, screen, density, dp, icon_size):
         self.screen = screen
         self.screen_width, self.screen_height = screen.get_size()
         self.density = density
         self.dp = dp
-        self.action_icon_size = dict(ldpi=18, mdpi=32, hdpi=36,
-            xhdpi=48)[density]
+        self.action_icon_size = bundle.ACTION_ICON_SIZES[density]
         print 'action_icon_size=%r' % self.action_icon_size
         self.icon_size = icon_size
+        # the packed images and font size, if bundle.py has been run
+        self.bundle = bundle.load(DATADIR, icon_size, density)
         self.columns = []
+        self.board = Board(SHAPES)
         self.score = 0
         self.score_changed = True
         self.score_multiplier = 1
@@ -176,6 +241,7 @@ class Game(object):
         self.need_match_search = False
         self.bad_swap_text_life = 0
         self.not_adjacent_text_life = 0
+        self.autosave_time = self.AUTOSAVE_INTERVAL
 
         if android:
             self.save_fn = 'save.state'
@@ -183,22 +249,23 @@ class Game(object):
             self.save_fn = os.path.expanduser('~/.match3.save')
 
         # find a good size for the font to render in icon_size-ish pixels
-        # height
-        size = 8
-        target_font_size = self.action_icon_size
-        while True:
-            self.font = pygame.font.Font(DATADIR + 'Roboto-Regular.ttf', size)
-            if self.font.get_linesize() >= target_font_size:
-                print 'font size=%r' % size
-                break
-            size += 1
+        # height (the bundle has it worked out already)
+        if self.bundle is not None:
+            size = self.bundle.font_size
+        else:
+            size = bundle.font_size(DATADIR + 'Roboto-Regular.ttf',
+                self.action_icon_size)
+        print 'font size=%r' % size
+        self.font = pygame.font.Font(DATADIR + 'Roboto-Regular.ttf', size)
         self.small_font = pygame.font.Font(DATADIR + 'Roboto-Regular.ttf',
             int(size * .75))
         self.bold_font = pygame.font.Font(DATADIR + 'Roboto-Bold.ttf', size)
+        self.text = TextCache()
 
     def reset(self):
         for column in self.columns:
             column.empty()
+            column.compact()
         self.grid_complete_and_settled = False
         self.score = 0
         self.score_multiplier = 1
@@ -207,73 +274,44 @@ class Game(object):
         self.all_dirty = True
 
     def load_state(self):
-        import os
         print 'attempt to load state from %s' % os.path.abspath(self.save_fn)
-        if not os.path.exists(self.save_fn):
+        self.save_file = SaveFile(self.save_fn)
+        state = self.save_file.load()
+        if state is None:
             return
         self.grid_complete_and_settled = True
-        with open(self.save_fn, 'rb') as f:
-            state = marshal.load(f)
-        self.high_score = state.get('high_score', 0)
-        self.score = state.get('score', 0)
-        self.splash_shown = state.get('splash_shown', False)
+        self.high_score = state['high_score']
+        self.score = state['score']
+        self.splash_shown = state['splash_shown']
         self.all_dirty = True
-        if 'columns' not in state:
+        if state['columns'] is None:
             return
 
         for n, column in enumerate(self.columns):
-            for block in state['columns'][n]:
-                shape = block['shape']
-                # backwards compatibility (1.1.1 -> 1.2.0)
-                if shape == 'cross':
-                    shape = 'spiral'
-                Block(self.play_y_offset, column, shape=shape,
-                    y_pos=block['y_pos'])
+            for k, shape in enumerate(state['columns'][n]):
+                y_pos = self.play_y_offset + (SIZE - 1 - k) * self.icon_size
+                Block(self.play_y_offset, column, shape=shape, y_pos=y_pos)
 
     def save_state(self):
-        state = dict(high_score=self.high_score, score=self.score,
-            splash_shown=self.splash_shown, columns=[[] for n in '.'*8])
-        for n, column in enumerate(self.columns):
-            for sprite in column._column_order:
-                state['columns'][n].append(dict(shape=sprite.shape,
-                    y_pos=sprite.target_y))
-
-        with open(self.save_fn + '.new', 'wb') as f:
-            marshal.dump(state, f)
-        # oh, Windows :-(
-        if platform.system() == 'Windows' and os.path.exists(self.save_fn):
-            os.remove(self.save_fn)
-        os.rename(self.save_fn + '.new', self.save_fn)
-        print 'STATE SAVED', os.path.abspath(self.save_fn)
+        # only the parts of the save file that have changed are written
+        columns = [[sprite.shape for sprite in column._column_order]
+            for column in self.columns]
+        if self.save_file.save(self.high_score, self.score,
+                self.splash_shown, columns):
+            print 'STATE SAVED', os.path.abspath(self.save_fn)
 
     def update(self, dt):
         self.effects_group.update(dt)
 
         if self.mode is self.MODE_HARD:
-            grid = {}
-            for column in self.columns:
-                for sprite in column._spritelist:
-                    x, y = sprite.rect.topleft
-                    grid[x, y] = sprite
-
             for n, column in enumerate(self.columns):
-                h = len(column)
-                if h == 8:
+                if len(column) == 8:
                     continue
 
                 # figure the shapes around the missing cell
                 shapes = set()
                 if random.random() < .8:
-                    if h:
-                        shapes.add(column._column_order[h-1].shape)
-                    if n:
-                        left = self.columns[n-1]._column_order
-                        if len(left) > h:
-                            shapes.add(left[h].shape)
-                    if n < 7:
-                        right = self.columns[n+1]._column_order
-                        if len(right) > h:
-                            shapes.add(right[h].shape)
+                    shapes = self.board.neighbour_shapes(n)
                 Block(self.play_y_offset, column, prevent_shapes=shapes)
 
         else:
@@ -303,55 +341,62 @@ class Game(object):
         if self.grid_complete_and_settled and self.is_game_over():
             self.game_over = True
 
-    def find_matches(self, remove=False, sprites=[]):
-        # create grid
-        grid = {}
+    def settled_heights(self):
+        # the number of blocks at rest in each column; a block can only come
+        # to rest on top of other blocks at rest
+        if self.grid_complete_and_settled:
+            return self.board.heights
+        heights = []
         for column in self.columns:
-            for sprite in column._spritelist:
-                if sprite.at_rest():
-                    x, y = sprite.rect.topleft
-                    grid[x, y] = sprite
-                else:
-                    self.grid_complete_and_settled = False
+            h = 0
+            for sprite in column._column_order:
+                if not sprite.at_rest():
+                    break
+                h += 1
+            heights.append(h)
+        return heights
 
+    def find_matches(self, remove=False, sprites=[]):
         if sprites:
-            # only test specific sprites
+            # only test specific sprites (and only against the sprites which
+            # are at rest)
+            heights = self.settled_heights()
             for sprite in sprites:
-                n = find_match(sprite, grid)
-                if len(n) > 2:
+                x, y = sprite.cell()
+                if len(self.board.group(x, y, heights)) > 2:
                     return True
             return False
 
-        # test grid
+        # only the cells changed since we last looked can be part of a new
+        # group; this is only ever called when the grid is settled
+        groups = self.board.find_groups(clear=remove)
+        if not remove:
+            return bool(groups)
+
+        # look up the sprites in every group before we start removing them
+        # (and thus moving the sprites above them down the column)
+        groups = [[self.columns[x]._column_order[SIZE - 1 - y]
+            for x, y in group] for group in groups]
+
         matches = False
         score = 0
-        for x in range(9):
-            for y in range(9):
-                sprite = grid.get((x*self.icon_size + self.play_x_offset,
-                    y*self.icon_size + self.play_y_offset))
-                if sprite is None:
-                    continue
-                n = find_match(sprite, grid)
-                N = len(n)
-                if N < 3:
-                    continue
-                if not remove:
-                    return True
+        for n in groups:
+            # any alteration to the grid clears the current selection
+            self._swap_start_sprite = None
 
-                # any alteration to the grid clears the current selection
-                self._swap_start_sprite = None
+            # add some score
+            score += self.score_multiplier * (2 ** (len(n)-3))
 
-                # add some score
-                score += self.score_multiplier * (2 ** (N-3))
+            # and remove the matched sprites
+            for s in n:
+                s.kill()
+            self.grid_complete_and_settled = False
+            matches = True
+            self.score_multiplier += 1
 
-                # and remove the matched sprites
-                for s in n:
-                    x, y = s.rect.topleft
-                    del grid[x, y]
-                    s.kill()
-                self.grid_complete_and_settled = False
-                matches = True
-                self.score_multiplier += 1
+        # now move the blocks above the removed ones down (once)
+        for column in self.columns:
+            column.compact()
 
 #        if matches:
 #            self.get_sound.play()
@@ -363,34 +408,9 @@ class Game(object):
         return matches
 
     def is_game_over(self):
-        # create grid - this is only ever called when the entire grid is
-        # created and settled
-        grid = {}
-        g = []
-        for column in self.columns:
-            l = []
-            g.append(l)
-            for sprite in column._spritelist:
-                grid[sprite.rect.topleft] = sprite
-                l.append(sprite.shape[0])
-
-        mod = self.icon_size
-        for (x, y), sprite in grid.items():
-            for xm, ym in (mod, 0), (-mod, 0), (0, mod), (0, -mod):
-                other = grid.get((x+xm, y+ym))
-                if other is None:
-                    continue
-
-                # swap for temp, find matches
-                sprite.shape, other.shape = other.shape, sprite.shape
-                m1 = find_match(sprite, grid)
-                m2 = find_match(other, grid)
-                sprite.shape, other.shape = other.shape, sprite.shape
-
-                if len(m1) > 2 or len(m2) > 2:
-                    return False
-
-        return True
+        # this is only ever called when the entire grid is created and
+        # settled; the board keeps track of the moves left as it changes
+        return not self.board.move_count()
 
     def do_about(self):
         lines = [line.strip() for line in '''*match 3
@@ -420,14 +440,16 @@ class Game(object):
             self.screen.fill((230, 230, 230))
             for line in lines:
                 if line.startswith('*'):
-                    text = self.bold_font.render(line[1:], True, (50, 50, 50))
+                    text = self.text.render(self.bold_font, line[1:],
+                        (50, 50, 50))
                 elif line.startswith('<'):
-                    text = self.small_font.render(line[1:], True, (150, 150, 150))
+                    text = self.text.render(self.small_font, line[1:],
+                        (150, 150, 150))
                 else:
                     if line.startswith('_'):
                         line = line[1:]
                         link_rect = pygame.rect.Rect((x - tw//2, y), (tw, th))
-                    text = self.font.render(line, True, (50, 50, 50))
+                    text = self.text.render(self.font, line, (50, 50, 50))
                 tw, th = text.get_size()
                 self.screen.blit(text, (x - tw//2, y))
                 y += fh
@@ -453,18 +475,26 @@ class Game(object):
                     self.all_dirty = True
                     return
 
+    def sprite_at(self, pos):
+        # find the block at rest under the screen position pos; a block at
+        # rest sits exactly in its cell of the play area and its place in the
+        # column tells us which cell that is, so we only need look at the one
+        # block whose place matches the cell under pos (blocks still falling
+        # can't be picked)
+        x = (pos[0] - self.play_x_offset) // self.icon_size
+        y = (pos[1] - self.play_y_offset) // self.icon_size
+        if not (0 <= x < SIZE and 0 <= y < SIZE):
+            return None
+        column = self.columns[x]._column_order
+        n = SIZE - 1 - y
+        if n >= len(column) or not column[n].at_rest():
+            return None
+        return column[n]
+
     _swap_start_sprite = None
     def mouse_down(self, pos):
         # set the swap sprite
-        self._swap_start_sprite = None
-        for column in self.columns:
-            for sprite in column._spritelist:
-                if not sprite.at_rest():
-                    continue
-
-                if sprite.rect.collidepoint(pos):
-                    self._swap_start_sprite = sprite
-                    return
+        self._swap_start_sprite = self.sprite_at(pos)
 
     def mouse_up(self, pos):
         self.score_multiplier = 1
@@ -483,53 +513,51 @@ class Game(object):
 
         start = self._swap_start_sprite
 
-        for column in self.columns:
-            for end in column._spritelist:
-                if not end.at_rest():
-                    continue
-
-                if not end.rect.collidepoint(pos):
-                    continue
+        end = self.sprite_at(pos)
+        if end is None:
+            return
 
-                if self._swap_end_sprite is not None:
-                    if end is self._swap_end_sprite:
-                        # same end sprite - nothing to do
-                        return
+        if self._swap_end_sprite is not None:
+            if end is self._swap_end_sprite:
+                # same end sprite - nothing to do
+                return
 
-                    old = self._swap_end_sprite
-                    # new end sprite - undo a previous swap
-                    old.shape, start.shape = start.shape, old.shape
-                    old.image, start.image = start.image, old.image
-                    start.dirty = old.dirty = 1
-                    self._swap_end_sprite = None
+            old = self._swap_end_sprite
+            # new end sprite - undo a previous swap
+            self.swap_shapes(old, start)
+            old.image, start.image = start.image, old.image
+            start.dirty = old.dirty = 1
+            self._swap_end_sprite = None
 
-                if end is start:
-                    return
+        if end is start:
+            return
 
-                # figure the distance to make sure our two selections are
-                # adjacent
-                d = abs(end.rect.x - start.rect.x)
-                d += abs(end.rect.y - start.rect.y)
-                if d > self.icon_size:
-                    # selection is too far away; it's the new swap
-                    self.flag_invalid_swap(end, adjacent=True)
-                    return
+        # figure the distance to make sure our two selections are
+        # adjacent
+        d = abs(end.rect.x - start.rect.x)
+        d += abs(end.rect.y - start.rect.y)
+        if d > self.icon_size:
+            # selection is too far away; it's the new swap
+            self.flag_invalid_swap(end, adjacent=True)
+            return
 
-                # do a temporary swap and test these specific sprites for
-                # matches
-                end.shape, start.shape = start.shape, end.shape
-                if not self.find_matches(sprites=[start, end]):
-                    self.flag_invalid_swap(end)
-                    # swap back the temp swap
-                    end.shape, start.shape = start.shape, end.shape
-                else:
-                    # swap the images as well
-                    end.image, start.image = start.image, end.image
-                    start.dirty = end.dirty = 1
-                    self._swap_end_sprite = end
+        # do a temporary swap and test these specific sprites for
+        # matches
+        self.swap_shapes(end, start)
+        if not self.find_matches(sprites=[start, end]):
+            self.flag_invalid_swap(end)
+            # swap back the temp swap
+            self.swap_shapes(end, start)
+        else:
+            # swap the images as well
+            end.image, start.image = start.image, end.image
+            start.dirty = end.dirty = 1
+            self._swap_end_sprite = end
 
-                # we've handled the hit so we're done
-                return
+    def swap_shapes(self, a, b):
+        # swap the shapes of two sprites, keeping the board up to date
+        a.shape, b.shape = b.shape, a.shape
+        self.board.swap(a.cell(), b.cell())
 
     def flag_invalid_swap(self, sprite, adjacent=False):
         # flag that a swap with the indicated sprite is invalid
@@ -556,15 +584,20 @@ class Game(object):
         # start us off with a blank slate
         self.screen.fill((230, 230, 230))
 
-        for name in SHAPES:
-            IMAGES[name] = pygame.image.load(DATADIR + '%s-%s.png' % (name,
-                self.icon_size))
+        if self.bundle is not None:
+            IMAGES.update(self.bundle.images)
+            self.cross = IMAGES.pop('cross')
+        else:
+            for name in SHAPES:
+                IMAGES[name] = pygame.image.load(DATADIR + '%s-%s.png' % (name,
+                    self.icon_size))
 
-        self.cross = pygame.image.load(DATADIR + 'cross-%s.png' % self.icon_size)
+            self.cross = pygame.image.load(DATADIR + 'cross-%s.png' %
+                self.icon_size)
 
-        for name in ACTIONS:
-            IMAGES[name] = pygame.image.load(DATADIR + '%s/%s.png' % (self.density,
-                name))
+            for name in bundle.ACTIONS:
+                IMAGES[name] = pygame.image.load(DATADIR + '%s/%s.png' % (
+                    self.density, name))
 
         clock = pygame.time.Clock()
 
@@ -594,6 +627,8 @@ class Game(object):
             g = ColumnGroup(_use_update=True)
             g.set_timing_treshold(1000.)
             g.x = self.play_x_offset + n * self.icon_size
+            g.index = n
+            g.board = self.board
             g.set_clip(self.screen.get_clip())
             self.columns.append(g)
 
@@ -632,6 +667,12 @@ class Game(object):
             dt = min(.1, clock.tick(30) / 1000.)
             self.update(dt)
 
+            # save every now and then while the grid's settled
+            self.autosave_time -= dt
+            if self.autosave_time <= 0 and self.grid_complete_and_settled:
+                self.save_state()
+                self.autosave_time = self.AUTOSAVE_INTERVAL
+
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     self.should_quit = True
@@ -692,8 +733,8 @@ class Game(object):
             # update score
             if self.all_dirty or self.score_changed:
                 # render the text and determine its dimensions
-                text = thousands(self.score)
-                text = self.font.render('Score: ' + text, True, (50, 50, 50))
+                text = self.text.render_number(self.font, self.score,
+                    (50, 50, 50), prefix='Score: ')
                 tw, th = text.get_size()
 
                 # draw the background to clear previous text
@@ -705,7 +746,7 @@ class Game(object):
                     score_y + score_height//2 - th //2))
 
                 if self.score == self.high_score:
-                    text = self.small_font.render('HIGH SCORE', True,
+                    text = self.text.render(self.small_font, 'HIGH SCORE',
                         (150, 150, 150))
                     tw, th = text.get_size()
                     y = score_y + score_height//2 + th //2
@@ -747,8 +788,8 @@ class Game(object):
                     (self.screen_width, pad)))
 
                 # render text, get dimensions
-                game_over_text = self.bold_font.render('Game Over', True,
-                    (50, 50, 50))
+                game_over_text = self.text.render(self.bold_font,
+                    'Game Over', (50, 50, 50))
                 tw, th = text.get_size()
 
                 # icon dimensions
@@ -0,0 +1,220 @@
+'''Saved match 3 games.
+
+A save file holds two copies of a small fixed size record:
+
+    magic 'M3SV', version, flags, sequence number, checksum  (16 bytes)
+    high score, score                                        (16 bytes)
+    shape grid, one byte per cell                            (64 bytes)
+
+Each save goes to the older of the two copies, and only the bytes which
+differ from what that copy already held are written (through a memory map of
+the file.) The header, carrying the new sequence number and a checksum of the
+whole record, is written last; if we're interrupted part way through a save
+the checksum won't match and loading falls back to the other copy.
+
+Games saved by older versions of the game (as a marshalled dict) are still
+loaded, and are replaced by this format the next time the game is saved.
+'''
+import os
+import mmap
+import zlib
+import struct
+import marshal
+import platform
+
+from board import SIZE
+
+MAGIC = 'M3SV'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+SCORES = struct.Struct('<QQ')
+RECORD_SIZE = HEADER.size + SCORES.size + SIZE * SIZE
+
+FLAG_SPLASH_SHOWN = 1
+
+# shapes are saved as their index in this list plus one (zero being an empty
+# cell) so never reorder it, only add to the end
+SHAPE_CODES = 'box circle diamond point spiral star triangle'.split()
+
+# shapes which have been renamed since they might have been saved
+RENAMED_SHAPES = dict(cross='spiral')
+
+
+def encode(sequence, high_score, score, splash_shown, columns):
+    '''Create a record from the state; columns is a list of the shapes in
+    each column from the bottom up.
+    '''
+    record = bytearray(RECORD_SIZE)
+    SCORES.pack_into(record, HEADER.size, high_score or 0, score)
+    grid = HEADER.size + SCORES.size
+    for x, column in enumerate(columns):
+        for n, shape in enumerate(column):
+            y = SIZE - 1 - n
+            record[grid + x * SIZE + y] = SHAPE_CODES.index(shape) + 1
+    flags = FLAG_SPLASH_SHOWN if splash_shown else 0
+    HEADER.pack_into(record, 0, MAGIC, VERSION, flags, sequence, 0)
+    HEADER.pack_into(record, 0, MAGIC, VERSION, flags, sequence,
+        checksum(record))
+    return record
+
+
+def checksum(record):
+    # everything but the checksum itself
+    return zlib.crc32(buffer(record, 0, HEADER.size - 4) +
+        buffer(record, HEADER.size)) & 0xffffffff
+
+
+def decode(record):
+    '''Return the state held in the record, or None if it's not valid.'''
+    if len(record) != RECORD_SIZE:
+        return None
+    magic, version, flags, sequence, crc = HEADER.unpack_from(record)
+    if magic != MAGIC or version != VERSION or crc != checksum(record):
+        return None
+    high_score, score = SCORES.unpack_from(record, HEADER.size)
+    grid = HEADER.size + SCORES.size
+    columns = []
+    for x in range(SIZE):
+        column = []
+        for y in reversed(range(SIZE)):
+            code = ord(record[grid + x * SIZE + y])
+            if not code:
+                break
+            column.append(SHAPE_CODES[code - 1])
+        columns.append(column)
+    return dict(sequence=sequence, high_score=high_score, score=score,
+        splash_shown=bool(flags & FLAG_SPLASH_SHOWN), columns=columns)
+
+
+def migrate(data):
+    '''Convert the marshalled dict saved by older versions of the game.'''
+    try:
+        state = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(state, dict):
+        return None
+    columns = None
+    if 'columns' in state:
+        columns = [[RENAMED_SHAPES.get(block['shape'], block['shape'])
+            for block in column] for column in state['columns']]
+    return dict(sequence=0, high_score=state.get('high_score', 0),
+        score=state.get('score', 0),
+        splash_shown=state.get('splash_shown', False), columns=columns)
+
+
+class SaveFile(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.map = None
+        # the valid records in each copy and which is the newest
+        self.records = [None, None]
+        self.current = None
+        self.sequence = 0
+
+    def load(self):
+        '''Return the saved state as a dict or None if there isn't one.
+
+        The columns are lists of the shapes from the bottom of each column
+        up; very old saves have no columns (it's None.)
+        '''
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            return migrate(data)
+        state = None
+        for n in 0, 1:
+            record = data[n * RECORD_SIZE:(n + 1) * RECORD_SIZE]
+            found = decode(record)
+            if found is None:
+                continue
+            self.records[n] = bytearray(record)
+            if state is None or found['sequence'] > state['sequence']:
+                state = found
+                self.current = n
+        if state is not None:
+            self.sequence = state['sequence']
+        return state
+
+    def save(self, high_score, score, splash_shown, columns):
+        '''Save the state, returning the number of bytes written.'''
+        if self.map is None:
+            self.open()
+        record = encode(self.sequence + 1, high_score, score, splash_shown,
+            columns)
+        if self.map is None:
+            self.create(record)
+            return RECORD_SIZE
+
+        # nothing to do if it's the same as the newest copy (apart from the
+        # sequence and checksum)
+        current = self.records[self.current]
+        if current[:8] == record[:8] and \
+                current[HEADER.size:] == record[HEADER.size:]:
+            return 0
+
+        # (the older copy may not be valid, so compare with what's really
+        # there rather than what we think it holds)
+        n = 1 - self.current
+        base = n * RECORD_SIZE
+        old = bytearray(self.map[base:base + RECORD_SIZE])
+
+        # write the changed parts of the body, then the header last
+        written = 0
+        start = None
+        for i in range(HEADER.size, RECORD_SIZE + 1):
+            if i < RECORD_SIZE and old[i] != record[i]:
+                if start is None:
+                    start = i
+            elif start is not None:
+                self.map[base + start:base + i] = str(record[start:i])
+                written += i - start
+                start = None
+        self.map.flush()
+        self.map[base:base + HEADER.size] = str(record[:HEADER.size])
+        self.map.flush()
+        written += HEADER.size
+
+        self.records[n] = record
+        self.current = n
+        self.sequence += 1
+        return written
+
+    def open(self):
+        # memory map the file if it's one of ours with a good copy in it
+        if not os.path.exists(self.filename) or \
+                os.path.getsize(self.filename) != RECORD_SIZE * 2:
+            return
+        if self.current is None:
+            with open(self.filename, 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    return
+            if self.load() is None:
+                return
+        self.file = open(self.filename, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), RECORD_SIZE * 2)
+
+    def create(self, record):
+        # write a complete new file holding just the record and move it into
+        # place so we never leave a broken file behind (or break an old save)
+        with open(self.filename + '.new', 'wb') as f:
+            f.write(str(record))
+            f.write('\0' * RECORD_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+        # oh, Windows :-(
+        if platform.system() == 'Windows' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(self.filename + '.new', self.filename)
+        self.records = [record, None]
+        self.current = 0
+        self.sequence = HEADER.unpack_from(record)[3]
+        self.open()
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
@@ -0,0 +1,187 @@
+'''Play match 3 without a screen.
+
+The Simulation plays by the same rules as the game (the same refilling of
+columns, removal of groups, scoring and game over) on a bare Board, with its
+own seedable random number generator and no need for pygame. Running this
+module plays lots of games using a simple computer player spread over all
+the CPUs and reports how they went, which is useful for seeing what the
+difficulty modes actually do:
+
+    python simulation.py [--games N] [--mode easy|hard ...]
+        [--policy random|greedy] [--max-moves N] [--seed N] [-o FILE]
+'''
+import json
+import time
+import random
+import argparse
+import multiprocessing
+
+from board import Board, SHAPES, SIZE
+
+MODE_EASY = 'easy'
+MODE_HARD = 'hard'
+
+
+class Simulation(object):
+    def __init__(self, seed=None, mode=MODE_HARD, shapes=SHAPES):
+        self.random = random.Random(seed)
+        self.mode = mode
+        self.board = Board(shapes)
+        self.score = 0
+        self.score_multiplier = 1
+        self.moves = 0
+        # the number of passes which removed groups after each move
+        self.cascades = []
+        # the game scores any groups in the initial fill too
+        self.settle()
+
+    def refill(self):
+        # the game adds a block to every column which isn't full each frame,
+        # so the blocks go in a row at a time across the columns
+        board = self.board
+        while min(board.heights) < SIZE:
+            for x in range(SIZE):
+                if board.heights[x] == SIZE:
+                    continue
+                # in hard mode the block mostly won't match the blocks it'll
+                # land next to
+                shapes = set()
+                if self.mode == MODE_HARD and self.random.random() < .8:
+                    shapes = board.neighbour_shapes(x)
+                board.push(x, self.random.choice([shape
+                    for shape in board.shapes if shape not in shapes]))
+
+    def settle(self):
+        '''Refill the board and remove groups until there are none left.
+
+        Returns the number of passes that removed groups.
+        '''
+        board = self.board
+        depth = 0
+        while True:
+            self.refill()
+            groups = board.find_groups(clear=True)
+            if not groups:
+                return depth
+            depth += 1
+            for group in groups:
+                self.score += self.score_multiplier * (2 ** (len(group) - 3))
+                self.score_multiplier += 1
+            removed = [[] for x in range(SIZE)]
+            for group in groups:
+                for x, y in group:
+                    removed[x].append(SIZE - 1 - y)
+            for x, positions in enumerate(removed):
+                if positions:
+                    board.remove(x, *positions)
+
+    def is_game_over(self):
+        return not self.board.move_count()
+
+    def play(self, move):
+        '''Swap the pair of (x, y) cells in move and let the board settle.'''
+        a, b = move
+        self.score_multiplier = 1
+        self.board.swap(a, b)
+        self.moves += 1
+        self.cascades.append(self.settle())
+
+    def group_size(self, move):
+        '''Return the number of blocks which would be in groups straight after
+        making the move.
+        '''
+        board = self.board
+        cells = board.cells
+        i = move[0][0] * SIZE + move[0][1]
+        j = move[1][0] * SIZE + move[1][1]
+        cells[i], cells[j] = cells[j], cells[i]
+        n = 0
+        for x, y in move:
+            group = board.group(x, y)
+            if len(group) > 2:
+                n += len(group)
+        cells[i], cells[j] = cells[j], cells[i]
+        return n
+
+
+def random_policy(sim):
+    return sim.random.choice(sim.board.legal_moves())
+
+def greedy_policy(sim):
+    # make the biggest group we can right now
+    return max(sim.board.legal_moves(), key=sim.group_size)
+
+POLICIES = dict(random=random_policy, greedy=greedy_policy)
+
+
+def play_game(args):
+    seed, mode, policy, max_moves = args
+    sim = Simulation(seed, mode)
+    choose = POLICIES[policy]
+    while sim.moves < max_moves and not sim.is_game_over():
+        sim.play(choose(sim))
+    return dict(score=sim.score, moves=sim.moves, cascades=sim.cascades,
+        game_over=sim.is_game_over())
+
+
+def self_play(games, mode, policy, max_moves, seed=0, processes=None):
+    '''Play a number of games across a pool of processes and summarise.'''
+    pool = multiprocessing.Pool(processes)
+    start = time.time()
+    jobs = [(seed + n, mode, policy, max_moves) for n in range(games)]
+    results = pool.map(play_game, jobs, chunksize=max(1, games // 64))
+    elapsed = time.time() - start
+    pool.close()
+    pool.join()
+
+    scores = sorted(r['score'] for r in results)
+    depths = {}
+    for r in results:
+        for depth in r['cascades']:
+            depths[depth] = depths.get(depth, 0) + 1
+    moves = sum(r['moves'] for r in results)
+    return dict(
+        games=games,
+        seconds=elapsed,
+        games_per_second=games / elapsed,
+        average_score=sum(scores) / float(games),
+        median_score=scores[games // 2],
+        average_moves=moves / float(games),
+        game_over_rate=sum(r['game_over'] for r in results) / float(games),
+        # how many moves set off that many passes of removing groups
+        cascade_depths=depths,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--games', type=int, default=1000,
+        help='number of games to play in each mode')
+    parser.add_argument('--mode', action='append',
+        choices=[MODE_EASY, MODE_HARD],
+        help='difficulty mode (may be repeated; default both)')
+    parser.add_argument('--policy', choices=sorted(POLICIES),
+        default='random', help='how the computer player picks its moves')
+    parser.add_argument('--max-moves', type=int, default=200,
+        help='give up on a game after this many moves')
+    parser.add_argument('--seed', type=int, default=0,
+        help='seed of the first game; the rest follow on from it')
+    parser.add_argument('--processes', type=int,
+        help='number of processes to use (default one per CPU)')
+    parser.add_argument('-o', '--output', help='write the JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.mode or [MODE_EASY, MODE_HARD]:
+        results[mode] = self_play(args.games, mode, args.policy,
+            args.max_moves, args.seed, args.processes)
+    results = json.dumps(dict(policy=args.policy, max_moves=args.max_moves,
+        modes=results), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+'''Cached text rendering.
+
+Rendering text with a pygame font is slow compared to blitting an image, and
+the game draws the same few strings over and over. A TextCache keeps every
+string it renders (per font and colour) and builds numbers, which change all
+the time, out of cached images of their individual digits.
+'''
+import pygame
+
+
+class TextCache(object):
+    def __init__(self):
+        # rendered strings and digit glyphs, keyed by (font, text, colour)
+        self.strings = {}
+        self.glyphs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, colour):
+        '''Return the text rendered (antialiased) in the font and colour.'''
+        key = (font, text, colour)
+        image = self.strings.get(key)
+        if image is None:
+            self.misses += 1
+            image = self.strings[key] = font.render(text, True, colour)
+        else:
+            self.hits += 1
+        return image
+
+    def glyph(self, font, char, colour):
+        key = (font, char, colour)
+        image = self.glyphs.get(key)
+        if image is None:
+            self.misses += 1
+            image = self.glyphs[key] = font.render(char, True, colour)
+        else:
+            self.hits += 1
+        return image
+
+    def render_number(self, font, number, colour, prefix=''):
+        '''Return the number (with thousands separators and after the
+        prefix) rendered from cached images of the prefix and each digit.
+        '''
+        images = []
+        if prefix:
+            images.append(self.render(font, prefix, colour))
+        images.extend(self.glyph(font, char, colour)
+            for char in '{:,}'.format(number))
+        w = sum(image.get_width() for image in images)
+        h = max(image.get_height() for image in images)
+        text = pygame.Surface((w, h), pygame.SRCALPHA, 32)
+        x = 0
+        for image in images:
+            # the images don't overlap so just copy them in, alpha and all
+            text.blit(image, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            x += image.get_width()
+        return text
+
+    def clear(self):
+        self.strings.clear()
+        self.glyphs.clear()
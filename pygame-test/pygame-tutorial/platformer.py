@@ -7,6 +7,7 @@ This code is placed in the Public Domain.
 '''
 import pygame
 import tmx
+from pool import Pool
 
 #
 # Our enemies are quite dumb, just moving from side to side between "reverse"
@@ -49,13 +50,26 @@ class Enemy(pygame.sprite.Sprite):
 class Bullet(pygame.sprite.Sprite):
     image = pygame.image.load('bullet.png')
     def __init__(self, location, direction, *groups):
-        super(Bullet, self).__init__(*groups)
+        super(Bullet, self).__init__()
         self.rect = pygame.rect.Rect(location, self.image.get_size())
+        self.fire(location, direction, *groups)
+
+    def fire(self, location, direction, *groups):
+        # (this is separate from __init__ so spent bullets may be fired again)
+        self.rect.topleft = location
         # movement in the X direction; postive is right, negative is left;
         # inherited from the player (shooter)
         self.direction = direction
         # time this bullet will live for in seconds
         self.lifespan = 1
+        self.add(*groups)
+        return self
+
+    def kill(self):
+        # remove the bullet from the game and keep it to be fired again
+        if self.alive():
+            super(Bullet, self).kill()
+            bullets.release(self)
 
     def update(self, dt, game):
         # decrement the lifespan of the bullet by the amount of time passed and
@@ -77,6 +91,10 @@ class Bullet(pygame.sprite.Sprite):
             # until its lifespan expires
             self.kill()
 
+# the player shoots a lot and bullets don't live long, so spent bullets are
+# kept here to be fired again rather than making a new one for every shot
+bullets = Pool(lambda: Bullet((0, 0), 1), 4)
+
 #
 # Our player of the game represented as a sprite with many attributes and user
 # control.
@@ -120,9 +138,9 @@ class Player(pygame.sprite.Sprite):
             # create a bullet at an appropriate position (the side of the player
             # sprite) and travelling in the correct direction
             if self.direction > 0:
-                Bullet(self.rect.midright, 1, game.sprites)
+                bullets.acquire().fire(self.rect.midright, 1, game.sprites)
             else:
-                Bullet(self.rect.midleft, -1, game.sprites)
+                bullets.acquire().fire(self.rect.midleft, -1, game.sprites)
             # set the amount of time until the player can shoot again
             self.gun_cooldown = 1
             game.shoot.play()
@@ -232,10 +250,10 @@ class Game(object):
             # since the last update (in seconds) and this Game object
             self.tilemap.update(dt / 1000., self)
             # construct the scene by drawing the background and then the rest of
-            # the game imagery over the top
-            screen.blit(background, (0, 0))
-            self.tilemap.draw(screen)
-            pygame.display.flip()
+            # the game imagery over the top; only the parts of the screen that
+            # have changed since the last frame are drawn and then updated on
+            # the display
+            pygame.display.update(self.tilemap.draw_dirty(screen, background))
 
             # terminate this main loop if the player dies; a simple change here
             # could be to replace the "print" with the invocation of a simple
@@ -0,0 +1,43 @@
+'''Pools of reusable objects.
+
+Games fire lots of bullets (and send in lots of creeps) which don't live
+long. Making a new sprite for each one and throwing it away soon after
+keeps the memory allocator and garbage collector busy, which can show up as
+stutters during heavy fire. A Pool instead keeps hold of the objects which
+are done with and hands them out again.
+
+    bullets = Pool(make_bullet, 16)
+    bullet = bullets.acquire()
+    ...
+    bullets.release(bullet)
+
+It's up to the user of the object to reset it when it's acquired.
+'''
+
+
+class Pool(object):
+    def __init__(self, factory, size=0):
+        '''factory is called (with no arguments) to make a new object when
+        the pool is empty; size objects are made up front.'''
+        self.factory = factory
+        self.free = []
+        # how many objects the pool has made, for keeping an eye on it
+        self.created = 0
+        self.reserve(size)
+
+    def reserve(self, size):
+        '''Make sure there's at least size objects ready to go.'''
+        while len(self.free) < size:
+            self.free.append(self.factory())
+            self.created += 1
+
+    def acquire(self):
+        '''Return a free object, making a new one if there's none left.'''
+        if self.free:
+            return self.free.pop()
+        self.created += 1
+        return self.factory()
+
+    def release(self, thing):
+        '''Give the object back to the pool to be acquired again.'''
+        self.free.append(thing)
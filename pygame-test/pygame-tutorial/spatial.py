@@ -0,0 +1,51 @@
+'''A uniform grid for finding the things near a point.
+
+Checking everything against everything else (every tower against every
+creep, every bullet against every creep) gets slow quickly as the numbers
+grow. Instead each frame the things are dropped into the square bucket of
+the grid their position falls in, and a search only looks in the buckets
+that overlap the area it's interested in.
+
+Distances are compared squared so there's no need for square roots.
+'''
+
+
+class SpatialGrid(object):
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        # lists of (thing, x, y) keyed by the (column, row) of their bucket
+        self.buckets = {}
+
+    def clear(self):
+        self.buckets.clear()
+
+    def add(self, thing, x, y):
+        '''Add the thing at position (x, y).'''
+        key = (int(x // self.cell_size), int(y // self.cell_size))
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = []
+        bucket.append((thing, x, y))
+
+    def near(self, x, y, radius):
+        '''Return the things less than radius away from (x, y).'''
+        size = self.cell_size
+        r2 = radius * radius
+        found = []
+        buckets = self.buckets
+        columns = range(int((x - radius) // size), int((x + radius) // size) + 1)
+        rows = range(int((y - radius) // size), int((y + radius) // size) + 1)
+        if len(buckets) < len(columns) * len(rows):
+            # there are fewer things about than places to look for them
+            keys = [(i, j) for i, j in buckets
+                if columns[0] <= i <= columns[-1] and rows[0] <= j <= rows[-1]]
+        else:
+            keys = [(i, j) for i in columns for j in rows]
+        for key in keys:
+            bucket = buckets.get(key)
+            if bucket is None:
+                continue
+            for thing, tx, ty in bucket:
+                if (tx - x) ** 2 + (ty - y) ** 2 < r2:
+                    found.append(thing)
+        return found
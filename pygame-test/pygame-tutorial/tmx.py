@@ -4,13 +4,25 @@
 
 # TODO: support properties on more things
 
+import os
 import sys
+import mmap
 import struct
+import hashlib
+import marshal
+import collections
+from array import array
 import pygame
 from pygame.locals import *
 from pygame import Rect
 from xml.etree import ElementTree
 
+# numpy is optional; it speeds up Layer.collide_many()
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Tile(object):
     def __init__(self, gid, surface, tileset):
@@ -57,14 +69,21 @@ class Tileset(object):
         self.firstgid = firstgid
         self.tiles = []
         self.properties = {}
+        # the image file the tiles were cut from
+        self.image_file = None
 
     @classmethod
     def fromxml(cls, tag, firstgid=None):
         if 'source' in tag.attrib:
             firstgid = int(tag.attrib['firstgid'])
-            with open(tag.attrib['source']) as f:
-                tileset = ElementTree.fromstring(f.read())
-            return cls.fromxml(tileset, firstgid)
+            source = tag.attrib['source']
+            tileset = tileset_cache.get_tileset(source, firstgid)
+            if tileset is None:
+                with open(source) as f:
+                    tileset = ElementTree.fromstring(f.read())
+                tileset = cls.fromxml(tileset, firstgid)
+                tileset_cache.add_tileset(source, tileset)
+            return tileset
 
         name = tag.attrib['name']
         if firstgid is None:
@@ -84,21 +103,101 @@ class Tileset(object):
         return tileset
 
     def add_image(self, file):
-        image = pygame.image.load(file).convert_alpha()
-        if not image:
-            sys.exit("Error creating new Tileset: file %s not found" % file)
+        self.image_file = file
         id = self.firstgid
-        for line in xrange(image.get_height() / self.tile_height):
-            for column in xrange(image.get_width() / self.tile_width):
-                pos = Rect(column * self.tile_width, line * self.tile_height,
-                    self.tile_width, self.tile_height)
-                self.tiles.append(Tile(id, image.subsurface(pos), self))
-                id += 1
+        for surface in tileset_cache.get_surfaces(file, self.tile_width,
+                self.tile_height):
+            self.tiles.append(Tile(id, surface, self))
+            id += 1
 
     def get_tile(self, gid):
         return self.tiles[gid - self.firstgid]
 
 
+class TilesetCache(object):
+    '''A process-wide cache of tileset images so they're only loaded and
+    cut up into tiles once, however many maps use them or however many
+    times a map is loaded.
+
+    The cache holds:
+
+        images - the loaded image Surfaces keyed off file name
+        surfaces - the tile Surfaces cut from an image keyed off (file name,
+                   tile_width, tile_height)
+        tilesets - Tilesets from external (.tsx) files keyed off (file
+                   name, firstgid)
+
+    Maps loading the same external tileset share its Tile objects
+    (including their properties.)
+
+    Nothing is ever removed from the cache automatically; use evict() or
+    clear(). The images are converted for the display mode current when
+    they're loaded so clear the cache if the mode changes.
+    '''
+    def __init__(self):
+        self.images = {}
+        self.surfaces = {}
+        self.tilesets = {}
+
+    def get_image(self, file):
+        '''Return the loaded image for the file.
+        '''
+        if file not in self.images:
+            image = pygame.image.load(file).convert_alpha()
+            if not image:
+                sys.exit("Error creating new Tileset: file %s not found" % file)
+            self.images[file] = image
+        return self.images[file]
+
+    def get_surfaces(self, file, tile_width, tile_height):
+        '''Return the list of tile_width x tile_height Surfaces cut from the
+        image in the file, in row-major order.
+        '''
+        key = (file, tile_width, tile_height)
+        if key not in self.surfaces:
+            image = self.get_image(file)
+            surfaces = []
+            for line in xrange(image.get_height() / tile_height):
+                for column in xrange(image.get_width() / tile_width):
+                    pos = Rect(column * tile_width, line * tile_height,
+                        tile_width, tile_height)
+                    surfaces.append(image.subsurface(pos))
+            self.surfaces[key] = surfaces
+        return self.surfaces[key]
+
+    def get_tileset(self, source, firstgid):
+        '''Return the Tileset loaded from the external source file with the
+        given firstgid, or None if it's not in the cache.
+        '''
+        return self.tilesets.get((source, firstgid))
+
+    def add_tileset(self, source, tileset):
+        '''Add the Tileset loaded from the external source file.
+        '''
+        self.tilesets[source, tileset.firstgid] = tileset
+
+    def evict(self, file):
+        '''Remove everything loaded from the file (an image or an external
+        tileset) from the cache.
+        '''
+        self.images.pop(file, None)
+        for key in list(self.surfaces):
+            if key[0] == file:
+                del self.surfaces[key]
+        for key, tileset in list(self.tilesets.items()):
+            if key[0] == file or tileset.image_file == file:
+                del self.tilesets[key]
+
+    def clear(self):
+        '''Remove everything from the cache.
+        '''
+        self.images.clear()
+        self.surfaces.clear()
+        self.tilesets.clear()
+
+tileset_cache = TilesetCache()
+
+
 class Tilesets(dict):
     def add(self, tileset):
         for i, tile in enumerate(tileset.tiles):
@@ -106,6 +205,10 @@ class Tilesets(dict):
             self[i] = tile
 
 
+# the shared (added, deleted) entry for cells with no property changes
+_NO_OVERRIDES = ({}, frozenset())
+
+
 class Cell(object):
     '''Layers are made of Cells (or empty space).
 
@@ -123,42 +226,91 @@ class Cell(object):
     You may assign a new value for a property to or even delete an existing
     property from the cell - this will not affect the Tile or any other Cells
     using the Cell's Tile.
+
+    Cells fetched from a Layer are lightweight views created on demand; any
+    property changes are stored in the Layer so they are seen by every view
+    of the same cell, and views of the same cell compare equal.
     '''
-    def __init__(self, x, y, px, py, tile):
+    def __init__(self, x, y, px, py, tile, layer=None):
         self.x, self.y = x, y
         self.px, self.py = px, py
         self.tile = tile
+        self.layer = layer
         self.topleft = (px, py)
         self.left = px
         self.right = px + tile.tile_width
         self.top = py
         self.bottom = py + tile.tile_height
         self.center = (px + tile.tile_width // 2, py + tile.tile_height // 2)
-        self._added_properties = {}
-        self._deleted_properties = set()
+        if layer is None:
+            self._overrides = ({}, set())
 
     def __repr__(self):
         return '<Cell %s,%s %d>' % (self.px, self.py, self.tile.gid)
 
+    def __eq__(self, other):
+        if self.layer is None or not isinstance(other, Cell):
+            return self is other
+        return (self.layer is other.layer and self.x == other.x and
+            self.y == other.y)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        if self.layer is None:
+            return id(self)
+        return hash((id(self.layer), self.x, self.y))
+
+    def _get_overrides(self, create=False):
+        # return the (added, deleted) property overrides for this cell
+        if self.layer is None:
+            return self._overrides
+        return self.layer.get_overrides(self.x, self.y, create)
+
+    @property
+    def _added_properties(self):
+        return self._get_overrides(True)[0]
+
+    @property
+    def _deleted_properties(self):
+        return self._get_overrides(True)[1]
+
     def __contains__(self, key):
-        if key in self._deleted_properties:
+        added, deleted = self._get_overrides()
+        if key in deleted:
             return False
-        return key in self._added_properties or key in self.tile.properties
+        return key in added or key in self.tile.properties
 
     def __getitem__(self, key):
-        if key in self._deleted_properties:
+        added, deleted = self._get_overrides()
+        if key in deleted:
             raise KeyError(key)
-        if key in self._added_properties:
-            return self._added_properties[key]
+        if key in added:
+            return added[key]
         if key in self.tile.properties:
             return self.tile.properties[key]
         raise KeyError(key)
 
     def __setitem__(self, key, value):
-        self._added_properties[key] = value
+        if self.layer is not None:
+            self.layer.unindex_property(self, key)
+        self._get_overrides(True)[0][key] = value
+        if self.layer is not None:
+            self.layer.index_property(self, key)
 
     def __delitem__(self, key):
-        self._deleted_properties.add(key)
+        if self.layer is not None:
+            self.layer.unindex_property(self, key)
+        self._get_overrides(True)[1].add(key)
+        if self.layer is not None:
+            self.layer.index_property(self, key)
+
+    def property_names(self):
+        '''Return the set of property names this cell has.
+        '''
+        added, deleted = self._get_overrides()
+        return (set(self.tile.properties) | set(added)) - deleted
 
     def intersects(self, other):
         '''Determine whether this Cell intersects with the other rect (which has
@@ -193,6 +345,48 @@ class LayerIterator(object):
         return value
 
 
+class LayerCells(collections.MutableMapping):
+    '''A dict-like view of the non-empty Cells of a Layer, keyed off (x, y)
+    index.
+
+    The Cells are created on demand from the Layer's gid grid.
+    '''
+    def __init__(self, layer):
+        self.layer = layer
+
+    def __getitem__(self, pos):
+        cell = self.layer.get_cell(*pos)
+        if cell is None:
+            raise KeyError(pos)
+        return cell
+
+    def __setitem__(self, pos, cell):
+        self.layer[pos] = cell.tile
+        added, deleted = cell._get_overrides()
+        if added or deleted:
+            self.layer.unindex_cell(*pos)
+            self.layer._overrides[pos] = (dict(added), set(deleted))
+            self.layer.index_cell(*pos)
+
+    def __delitem__(self, pos):
+        if pos not in self:
+            raise KeyError(pos)
+        self.layer.clear(*pos)
+
+    def __contains__(self, pos):
+        return self.layer.get_tile(*pos) is not None
+
+    def __iter__(self):
+        layer = self.layer
+        w = layer.width
+        for n, gid in enumerate(layer.gids):
+            if gid:
+                yield n % w, n // w
+
+    def __len__(self):
+        return len(self.layer.gids) - self.layer.gids.count(0)
+
+
 class Layer(object):
     '''A 2d grid of Cells.
 
@@ -203,15 +397,42 @@ class Layer(object):
         px_width, px_height - the dimensions of the Layer in pixels
         tilesets - the tilesets used in this Layer (a Tilesets instance)
         properties - any properties set for this Layer
-        cells - a dict of all the Cell instances for this Layer, keyed off
-                (x, y) index.
+        cells - a dict-like view of all the Cell instances for this Layer,
+                keyed off (x, y) index.
+        gids - the tile gid of each cell in row-major order (an array; 0
+               is an empty cell.)
 
     Additionally you may look up a cell using direct item access:
 
-       layer[x, y] is layer.cells[x, y]
+       layer[x, y] == layer.cells[x, y]
 
     Note that empty cells will be set to None instead of a Cell instance.
+
+    The Layer only stores tile gids and any per-cell property changes; the
+    Cell instances are created when they're asked for, so each look-up
+    returns a new (but equal) Cell.
+
+    The first call to find() or match() builds an index of the cells by
+    property name and value which is then kept up to date as cells and
+    their properties change.
+
+    Layers loaded from a TMX file keep their encoded tile data until the
+    gids are first needed (when the layer is drawn or queried.)
+
+    If numpy is available collide_many() keeps a boolean mask over the
+    cells for each property name it's asked about.
+
+    Layers may optionally be drawn in "chunked" mode by setting chunk_size
+    (a number of cells). Blocks of chunk_size x chunk_size cells are then
+    pre-rendered into Surfaces and the most recently drawn of them are kept
+    around (enough to cover the viewport wherever it is, plus a few more,
+    and never fewer than chunk_cache_size), so each frame only the few
+    chunks intersecting the viewport are blitted. Tiles larger than the layer's
+    tile size will be clipped at chunk boundaries in this mode.
     '''
+    chunk_size = None
+    chunk_cache_size = 16
+
     def __init__(self, name, visible, map):
         self.name = name
         self.visible = visible
@@ -226,19 +447,141 @@ class Layer(object):
         self.tilesets = map.tilesets
         self.group = pygame.sprite.Group()
         self.properties = {}
-        self.cells = {}
+        self._gids = array('i', [0]) * (self.width * self.height)
+        # the encoded tile data, if not yet decoded into _gids
+        self._payload = None
+        self.cells = LayerCells(self)
+        # per-cell property changes, keyed off (x, y) index
+        self._overrides = {}
+        # tiles not found in our tilesets, keyed off (x, y) index
+        self._custom_tiles = {}
+        self._chunks = collections.OrderedDict()
+        # property name -> set of (x, y) and (name, value) -> set of (x, y);
+        # None until first needed
+        self._name_index = None
+        self._value_index = None
+        # property name -> numpy mask of the cells with it, and the summed
+        # area table of that mask
+        self._masks = {}
+        self._mask_tables = {}
 
     def __repr__(self):
         return '<Layer "%s" at 0x%x>' % (self.name, id(self))
 
+    def _get_gids(self):
+        # decode the layer data if it hasn't been yet
+        if self._payload is not None:
+            self._gids = self.decode(self._payload)
+            self._payload = None
+        return self._gids
+
+    def _set_gids(self, gids):
+        self._gids = gids
+        self._payload = None
+
+    gids = property(_get_gids, _set_gids)
+
+    def decode(self, payload):
+        '''Decode base64, zlib-compressed TMX layer data (or the raw
+        little-endian gids in a buffer from a compiled map) into an array
+        of gids.
+        '''
+        if isinstance(payload, buffer):
+            data = payload
+        else:
+            data = payload.decode('base64').decode('zlib')
+        gids = array('i')
+        gids.fromstring(data)
+        if sys.byteorder == 'big':
+            gids.byteswap()
+        if len(gids) != self.width * self.height:
+            raise ValueError('layer %s has %d cells, expected %d' % (
+                self.name, len(gids), self.width * self.height))
+        # Tiled sets the top bits of a gid to flip the tile; we can't draw
+        # flipped tiles (or any other gid not in our tilesets) so those cells
+        # are left empty; the distinct gids are checked first as there's
+        # usually none to fix
+        bad = set(gids).difference(self.tilesets)
+        bad.discard(0)
+        if bad:
+            for n, gid in enumerate(gids):
+                if gid in bad:
+                    gids[n] = 0
+        return gids
+
     def __getitem__(self, pos):
-        return self.cells.get(pos)
+        return self.get_cell(*pos)
 
     def __setitem__(self, pos, tile):
         x, y = pos
-        px = x * self.tile_width
-        py = y * self.tile_width
-        self.cells[pos] = Cell(x, y, px, py, tile)
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise IndexError(pos)
+        self.unindex_cell(x, y)
+        self._overrides.pop(pos, None)
+        if tile.gid and self.tilesets.get(tile.gid) is tile:
+            self._custom_tiles.pop(pos, None)
+            self.gids[y * self.width + x] = tile.gid
+        else:
+            # (the -1 only marks the cell as not empty; the tile itself is
+            # looked up in _custom_tiles)
+            self._custom_tiles[pos] = tile
+            self.gids[y * self.width + x] = -1
+        self.index_cell(x, y)
+        self.update_masks(x, y)
+        self.invalidate_chunk(x, y)
+
+    def clear(self, x, y):
+        '''Make the cell at index (x, y) empty.
+        '''
+        self.unindex_cell(x, y)
+        self._overrides.pop((x, y), None)
+        self._custom_tiles.pop((x, y), None)
+        self.gids[y * self.width + x] = 0
+        self.update_masks(x, y)
+        self.invalidate_chunk(x, y)
+
+    def get_tile(self, x, y):
+        '''Return the Tile at index (x, y) or None if the cell is empty.
+        '''
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        gid = self.gids[y * self.width + x]
+        if gid > 0:
+            return self.tilesets[gid]
+        if self._custom_tiles:
+            return self._custom_tiles.get((x, y))
+        return None
+
+    def get_cell(self, x, y):
+        '''Return a Cell for index (x, y) or None if the cell is empty.
+        '''
+        tile = self.get_tile(x, y)
+        if tile is None:
+            return None
+        return Cell(x, y, x * self.tile_width, y * self.tile_height, tile,
+            self)
+
+    def get_overrides(self, x, y, create=False):
+        '''Return the (added, deleted) property changes made to the cell at
+        index (x, y).
+
+        If the cell has no changes then a new empty entry is stored and
+        returned when create is True, otherwise a shared empty entry is
+        returned which must not be modified.
+        '''
+        overrides = self._overrides.get((x, y))
+        if overrides is None:
+            if not create:
+                return _NO_OVERRIDES
+            overrides = self._overrides[x, y] = ({}, set())
+        return overrides
+
+    def iter_cells(self):
+        '''Iterate over all the non-empty Cells in this layer in row-major
+        order.
+        '''
+        for x, y in self.cells:
+            yield self.get_cell(x, y)
 
     def __iter__(self):
         return LayerIterator(self)
@@ -251,16 +594,8 @@ class Layer(object):
         if data is None:
             raise ValueError('layer %s does not contain <data>' % layer.name)
 
-        data = data.text.strip()
-        data = data.decode('base64').decode('zlib')
-        data = struct.unpack('<%di' % (len(data)/4,), data)
-        assert len(data) == layer.width * layer.height
-        for i, gid in enumerate(data):
-            if gid < 1: continue   # not set
-            tile = map.tilesets[gid]
-            x = i % layer.width
-            y = i // layer.width
-            layer.cells[x,y] = Cell(x, y, x*map.tile_width, y*map.tile_height, tile)
+        # the data is decoded when first needed
+        layer._payload = data.text.strip()
 
         return layer
 
@@ -274,40 +609,214 @@ class Layer(object):
         y -= viewport_oy
         self.position = (x, y)
 
+    def visible_range(self, surface, w, h):
+        '''Return the (i1, i2, j1, j2) index ranges of the w x h pixel blocks
+        of this layer which are in both the viewport and the Surface's clip
+        area.
+        '''
+        ox, oy = self.position
+        area = Rect(self.view_x, self.view_y, self.view_w, self.view_h)
+        area = area.clip(surface.get_clip().move(ox, oy))
+        if not area.width or not area.height:
+            return 0, 0, 0, 0
+        return (area.left // w, (area.right - 1) // w + 1,
+            area.top // h, (area.bottom - 1) // h + 1)
+
     def draw(self, surface):
-        '''Draw this layer, limited to the current viewport, to the Surface.
+        '''Draw this layer, limited to the current viewport and the Surface's
+        clip area, to the Surface.
         '''
+        if self.chunk_size:
+            return self.draw_chunks(surface)
         ox, oy = self.position
-        w, h = self.view_w, self.view_h
-        for x in range(ox, ox + w + self.tile_width, self.tile_width):
-            i = x // self.tile_width
-            for y in range(oy, oy + h + self.tile_height, self.tile_height):
-                j = y // self.tile_height
-                if (i, j) not in self.cells:
+        i1, i2, j1, j2 = self.visible_range(surface, self.tile_width,
+            self.tile_height)
+        for i in range(i1, i2):
+            for j in range(j1, j2):
+                tile = self.get_tile(i, j)
+                if tile is None:
                     continue
-                cell = self.cells[i, j]
-                surface.blit(cell.tile.surface, (cell.px - ox, cell.py - oy))
+                surface.blit(tile.surface, (i * self.tile_width - ox,
+                    j * self.tile_height - oy))
+
+    def draw_chunks(self, surface):
+        '''Draw this layer using the pre-rendered chunk cache.
+        '''
+        ox, oy = self.position
+        cw = self.chunk_size * self.tile_width
+        ch = self.chunk_size * self.tile_height
+        ci1, ci2, cj1, cj2 = self.visible_range(surface, cw, ch)
+        for ci in range(ci1, ci2):
+            for cj in range(cj1, cj2):
+                chunk = self.get_chunk(ci, cj)
+                if chunk is not None:
+                    surface.blit(chunk, (ci * cw - ox, cj * ch - oy))
+
+    def get_chunk(self, ci, cj):
+        '''Return the pre-rendered Surface for chunk (ci, cj), rendering it
+        if it's not in the cache.
+
+        Return None if the chunk contains no cells.
+        '''
+        key = (ci, cj)
+        if key in self._chunks:
+            # move to the most-recently-used end of the cache
+            chunk = self._chunks.pop(key)
+            self._chunks[key] = chunk
+            return chunk
+
+        n = self.chunk_size
+        chunk = None
+        for i in range(ci * n, ci * n + n):
+            for j in range(cj * n, cj * n + n):
+                tile = self.get_tile(i, j)
+                if tile is None:
+                    continue
+                if chunk is None:
+                    chunk = pygame.Surface((n * self.tile_width,
+                        n * self.tile_height), SRCALPHA, 32)
+                chunk.blit(tile.surface, ((i - ci * n) * self.tile_width,
+                    (j - cj * n) * self.tile_height))
+
+        self._chunks[key] = chunk
+        limit = self.chunk_cache_limit()
+        while len(self._chunks) > limit:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def chunk_cache_limit(self):
+        '''Return the number of chunks to keep in the cache.
+
+        A viewport n chunks wide can overlap n + 1 of them, so that many
+        across and down (plus a margin for scrolling back and forth) are
+        kept.
+        '''
+        cw = self.chunk_size * self.tile_width
+        ch = self.chunk_size * self.tile_height
+        across = -(-getattr(self, 'view_w', 0) // cw) + 1
+        down = -(-getattr(self, 'view_h', 0) // ch) + 1
+        return max(self.chunk_cache_size, across * down + across + down)
+
+    def invalidate_chunk(self, x, y):
+        '''Discard the cached chunk containing the cell at index (x, y).
+        '''
+        if self.chunk_size:
+            self._chunks.pop((x // self.chunk_size, y // self.chunk_size),
+                None)
+
+    def invalidate_chunks(self):
+        '''Discard all cached chunks.
+        '''
+        self._chunks.clear()
+
+    def build_index(self):
+        '''Build the property index used by find() and match().
+        '''
+        self._name_index = collections.defaultdict(set)
+        self._value_index = collections.defaultdict(set)
+        # property names with unhashable values can't be in the value index
+        self._unhashable = set()
+
+        # cells with changed properties or custom tiles are indexed one by
+        # one, the rest straight from their tile's properties
+        special = set(self._overrides) | set(self._custom_tiles)
+        interesting = set(gid for gid in set(self.gids)
+            if gid > 0 and self.tilesets[gid].properties)
+        w = self.width
+        for n, gid in enumerate(self.gids):
+            if gid not in interesting:
+                continue
+            pos = (n % w, n // w)
+            if pos in special:
+                continue
+            for key, value in self.tilesets[gid].properties.items():
+                self._name_index[key].add(pos)
+                try:
+                    self._value_index[key, value].add(pos)
+                except TypeError:
+                    self._unhashable.add(key)
+        for x, y in special:
+            self.index_cell(x, y)
+
+    def index_property(self, cell, key):
+        '''Add the cell's key property to the index (if it has it.)
+        '''
+        if key in self._masks:
+            self._masks[key][cell.y, cell.x] = key in cell
+            self._mask_tables.pop(key, None)
+        if self._name_index is None or key not in cell:
+            return
+        pos = (cell.x, cell.y)
+        self._name_index[key].add(pos)
+        try:
+            self._value_index[key, cell[key]].add(pos)
+        except TypeError:
+            self._unhashable.add(key)
+
+    def unindex_property(self, cell, key):
+        '''Remove the cell's key property from the index.
+        '''
+        if self._name_index is None or key not in cell:
+            return
+        pos = (cell.x, cell.y)
+        self._name_index[key].discard(pos)
+        try:
+            self._value_index[key, cell[key]].discard(pos)
+        except TypeError:
+            pass
+
+    def index_cell(self, x, y):
+        '''Add all of the properties of the cell at (x, y) to the index.
+        '''
+        if self._name_index is None:
+            return
+        cell = self.get_cell(x, y)
+        if cell is not None:
+            for key in cell.property_names():
+                self.index_property(cell, key)
+
+    def unindex_cell(self, x, y):
+        '''Remove all of the properties of the cell at (x, y) from the index.
+        '''
+        if self._name_index is None:
+            return
+        cell = self.get_cell(x, y)
+        if cell is not None:
+            for key in cell.property_names():
+                self.unindex_property(cell, key)
+
+    def _indexed_cells(self, positions):
+        # Cells for the indexed positions in row-major order
+        return [self.get_cell(x, y)
+            for y, x in sorted((y, x) for x, y in positions)]
 
     def find(self, *properties):
         '''Find all cells with the given properties set.
         '''
+        if self._name_index is None:
+            self.build_index()
         r = []
         for propname in properties:
-            for cell in self.cells.values():
-                if cell and propname in cell:
-                    r.append(cell)
+            r.extend(self._indexed_cells(self._name_index.get(propname, ())))
         return r
 
     def match(self, **properties):
         '''Find all cells with the given properties set to the given values.
         '''
+        if self._name_index is None:
+            self.build_index()
         r = []
         for propname in properties:
-            for cell in self.cells.values():
-                if propname not in cell:
-                    continue
-                if properties[propname] == cell[propname]:
-                    r.append(cell)
+            value = properties[propname]
+            try:
+                if propname in self._unhashable:
+                    raise TypeError(propname)
+                positions = self._value_index.get((propname, value), ())
+            except TypeError:
+                # fall back to testing each cell with the property
+                positions = [pos for pos in self._name_index.get(propname, ())
+                    if self.get_cell(*pos)[propname] == value]
+            r.extend(self._indexed_cells(positions))
         return r
 
     def collide(self, rect, propname):
@@ -323,6 +832,78 @@ class Layer(object):
                 r.append(cell)
         return r
 
+    def get_mask(self, propname):
+        '''Return a (height, width) numpy boolean array which is True for
+        the cells with the indicated property name set.
+
+        The mask is kept up to date as the cells change.
+        '''
+        if propname in self._masks:
+            return self._masks[propname]
+        has = numpy.zeros(max(self.tilesets.keys() + [0]) + 1, bool)
+        for gid, tile in self.tilesets.items():
+            has[gid] = propname in tile.properties
+        gids = numpy.frombuffer(self.gids, numpy.int32)
+        mask = has[gids.clip(0, None)].reshape(self.height, self.width)
+        for x, y in set(self._overrides) | set(self._custom_tiles):
+            cell = self.get_cell(x, y)
+            mask[y, x] = cell is not None and propname in cell
+        self._masks[propname] = mask
+        return mask
+
+    def update_masks(self, x, y):
+        '''Update the property masks for the cell at index (x, y).
+        '''
+        if not self._masks:
+            return
+        cell = self.get_cell(x, y)
+        for propname, mask in self._masks.items():
+            mask[y, x] = cell is not None and propname in cell
+        self._mask_tables.clear()
+
+    def collide_many(self, rects, propname):
+        '''Find all cells each of the rects is touching that have the
+        indicated property name set.
+
+        Returns a list holding a list of Cells for each rect; the same as
+        calling collide() for each rect but much faster for many rects if
+        numpy is available.
+        '''
+        if numpy is None:
+            return [self.collide(rect, propname) for rect in rects]
+        rects = list(rects)
+        r = [[] for rect in rects]
+        if not rects:
+            return r
+
+        # the cell index ranges for each rect, as in get_in_region()
+        bounds = numpy.array([(rect.left, rect.top, rect.right, rect.bottom)
+            for rect in rects], int)
+        i1 = (bounds[:, 0] // self.tile_width).clip(0, self.width)
+        j1 = (bounds[:, 1] // self.tile_height).clip(0, self.height)
+        i2 = numpy.maximum(i1, (bounds[:, 2] // self.tile_width + 1).clip(0,
+            self.width))
+        j2 = numpy.maximum(j1, (bounds[:, 3] // self.tile_height + 1).clip(0,
+            self.height))
+
+        # count the cells with the property in every range in one go using
+        # a summed area table, then only look closer at the rects with some
+        mask = self.get_mask(propname)
+        table = self._mask_tables.get(propname)
+        if table is None:
+            table = numpy.zeros((self.height + 1, self.width + 1), numpy.int32)
+            table[1:, 1:] = mask.cumsum(0).cumsum(1)
+            self._mask_tables[propname] = table
+        counts = table[j2, i2] - table[j1, i2] - table[j2, i1] + table[j1, i1]
+        for n in numpy.flatnonzero(counts):
+            rect = rects[n]
+            found = mask[j1[n]:j2[n], i1[n]:i2[n]].T.nonzero()
+            for i, j in zip(*found):
+                cell = self.get_cell(int(i1[n] + i), int(j1[n] + j))
+                if cell.intersects(rect):
+                    r[n].append(cell)
+        return r
+
     def get_in_region(self, x1, y1, x2, y2):
         '''Return cells (in [column][row]) that are within the map-space
         pixel bounds specified by the bottom-left (x1, y1) and top-right
@@ -334,10 +915,13 @@ class Layer(object):
         j1 = max(0, y1 // self.tile_height)
         i2 = min(self.width, x2 // self.tile_width + 1)
         j2 = min(self.height, y2 // self.tile_height + 1)
-        return [self.cells[i, j]
-            for i in range(int(i1), int(i2))
-                for j in range(int(j1), int(j2))
-                    if (i, j) in self.cells]
+        r = []
+        for i in range(int(i1), int(i2)):
+            for j in range(int(j1), int(j2)):
+                cell = self.get_cell(i, j)
+                if cell is not None:
+                    r.append(cell)
+        return r
 
     def get_at(self, x, y):
         '''Return the cell at the nominated (x, y) coordinate.
@@ -346,7 +930,7 @@ class Layer(object):
         '''
         i = x // self.tile_width
         j = y // self.tile_height
-        return self.cells.get((i, j))
+        return self.get_cell(int(i), int(j))
 
     def neighbors(self, index):
         '''Return the indexes of the valid (ie. within the map) cardinal (ie.
@@ -398,6 +982,8 @@ visible: Whether the object is shown (1) or hidden (0). Defaults to 1.
         self.tile = tile
         self.visible = visible
         self.properties = {}
+        # the ObjectLayer this object is in, if any
+        self.layer = None
 
         self._added_properties = {}
         self._deleted_properties = set()
@@ -487,6 +1073,22 @@ visible: Whether the object is shown (1) or hidden (0). Defaults to 1.
             return False
         return True
 
+    def contains(self, x, y):
+        '''Determine whether the (x, y) pixel is within this object's bounds
+        (inclusive.)
+        '''
+        return self.intersects(x, y, x, y)
+
+    def set_position(self, x, y):
+        '''Move this object so its top-left corner is at pixel (x, y).
+        '''
+        self.px = self.left = x
+        self.right = x + self.width
+        self.py = self.top = y
+        self.bottom = y + self.height
+        if self.layer is not None:
+            self.layer.update_object(self)
+
 
 class ObjectLayer(object):
     '''A layer composed of basic primitive shapes.
@@ -502,16 +1104,31 @@ class ObjectLayer(object):
         opacity - the opacity of the layer as a value from 0 to 1.
         visible - whether the layer is shown (1) or hidden (0).
         objects - the objects in this Layer (Object instances)
+
+    The objects are indexed in a uniform grid of grid_size pixel squares to
+    speed up the region, point and rect queries. Use add_object(),
+    remove_object() and Object.set_position() to keep the index up to date
+    rather than modifying the objects list or object positions directly.
     '''
+    grid_size = 128
+
     def __init__(self, name, color, objects, opacity=1,
             visible=1, position=(0, 0)):
         self.name = name
         self.color = color
-        self.objects = objects
+        self.objects = []
         self.opacity = opacity
         self.visible = visible
         self.position = position
         self.properties = {}
+        # grid square -> set of objects, object -> its grid squares and
+        # object -> its order in the objects list
+        self._grid = collections.defaultdict(set)
+        self._object_squares = {}
+        self._object_order = {}
+        self._next_order = 0
+        for object in objects:
+            self.add_object(object)
 
     def __repr__(self):
         return '<ObjectLayer "%s" at 0x%x>' % (self.name, id(self))
@@ -522,7 +1139,7 @@ class ObjectLayer(object):
             float(tag.attrib.get('opacity', 1)),
             int(tag.attrib.get('visible', 1)))
         for object in tag.findall('object'):
-            layer.objects.append(Object.fromxml(object, map))
+            layer.add_object(Object.fromxml(object, map))
         for c in tag.findall('property'):
             # store additional properties.
             name = c.attrib['name']
@@ -534,6 +1151,49 @@ class ObjectLayer(object):
             layer.properties[name] = value
         return layer
 
+    def add_object(self, object):
+        '''Add the Object to this layer.
+        '''
+        self.objects.append(object)
+        object.layer = self
+        self._object_order[object] = self._next_order
+        self._next_order += 1
+        self._index_object(object)
+
+    def remove_object(self, object):
+        '''Remove the Object from this layer.
+        '''
+        self.objects.remove(object)
+        self._unindex_object(object)
+        del self._object_order[object]
+        object.layer = None
+
+    def update_object(self, object):
+        '''Update the index for an Object that has moved.
+        '''
+        self._unindex_object(object)
+        self._index_object(object)
+
+    def _squares(self, x1, y1, x2, y2):
+        # the grid squares covering the pixel bounds
+        g = self.grid_size
+        return [(i, j) for i in range(int(x1 // g), int(x2 // g) + 1)
+            for j in range(int(y1 // g), int(y2 // g) + 1)]
+
+    def _index_object(self, object):
+        squares = self._squares(object.px, object.py,
+            object.px + object.width, object.py + object.height)
+        for square in squares:
+            self._grid[square].add(object)
+        self._object_squares[object] = squares
+
+    def _unindex_object(self, object):
+        for square in self._object_squares.pop(object):
+            objects = self._grid[square]
+            objects.discard(object)
+            if not objects:
+                del self._grid[square]
+
     def update(self, dt, *args):
         pass
 
@@ -598,16 +1258,26 @@ class ObjectLayer(object):
 
         Return a list of Object instances.
         '''
-        return [obj for obj in self.objects if obj.intersects(x1, y1, x2, y2)]
+        if x1 > x2 or y1 > y2:
+            # an inverted region doesn't map to grid squares
+            return [obj for obj in self.objects
+                if obj.intersects(x1, y1, x2, y2)]
+        found = set()
+        for square in self._squares(x1, y1, x2, y2):
+            if square in self._grid:
+                found.update(self._grid[square])
+        found = [obj for obj in found if obj.intersects(x1, y1, x2, y2)]
+        found.sort(key=self._object_order.get)
+        return found
 
     def get_at(self, x, y):
         '''Return the first object found at the nominated (x, y) coordinate.
 
         Return an Object instance or None.
         '''
-        for object in self.objects:
-            if object.contains(x,y):
-                return object
+        found = self.get_in_region(x, y, x, y)
+        if found:
+            return found[0]
 
 
 class SpriteLayer(pygame.sprite.AbstractGroup):
@@ -629,6 +1299,18 @@ class SpriteLayer(pygame.sprite.AbstractGroup):
             sx, sy = sprite.rect.topleft
             screen.blit(sprite.image, (sx-ox, sy-oy))
 
+def _merge_rects(rects):
+    # merge overlapping Rects so no area is drawn twice
+    merged = []
+    for rect in rects:
+        while True:
+            n = rect.collidelist(merged)
+            if n < 0:
+                break
+            rect = rect.union(merged.pop(n))
+        merged.append(rect)
+    return merged
+
 class Layers(list):
     def __init__(self):
         self.by_name = {}
@@ -639,7 +1321,7 @@ class Layers(list):
 
     def __getitem__(self, item):
         if isinstance(item, int):
-            return self[item]
+            return list.__getitem__(self, item)
         return self.by_name[item]
 
 class TileMap(object):
@@ -668,6 +1350,10 @@ class TileMap(object):
         view_x, view_y - viewport offset (origin)
         viewport - a Rect instance giving the current viewport specification
 
+    TileMaps may be drawn with draw() which draws everything, or with
+    draw_dirty() which only redraws the parts of the screen which have
+    changed since the last draw_dirty() and returns them for passing to
+    pygame.display.update().
     '''
     def __init__(self, size, origin=(0,0)):
         self.px_width = 0
@@ -683,6 +1369,7 @@ class TileMap(object):
         self.view_w, self.view_h = size     # viewport size
         self.view_x, self.view_y = origin   # viewport offset
         self.viewport = Rect(origin, size)
+        self._dirty_rects = []              # map-space rects for draw_dirty
 
     def update(self, dt, *args):
         for layer in self.layers:
@@ -693,29 +1380,227 @@ class TileMap(object):
             if layer.visible:
                 layer.draw(screen)
 
+    # state from the last draw_dirty(); None forces a full redraw
+    _drawn_viewport = None
+    _drawn_sprites = None
+
+    def mark_dirty(self, rect=None):
+        '''Have the next draw_dirty() redraw the map-space rect, or
+        everything if no rect is given.
+
+        This is needed when the tile or object layers are changed.
+        '''
+        if rect is None:
+            self._drawn_viewport = None
+        else:
+            self._dirty_rects.append(Rect(rect))
+
+    def _sprite_state(self):
+        # the map-space rect and image of each sprite in the SpriteLayers
+        state = {}
+        for layer in self.layers:
+            if isinstance(layer, SpriteLayer) and layer.visible:
+                for sprite in layer.sprites():
+                    rect = Rect(sprite.rect.topleft, sprite.image.get_size())
+                    state[sprite] = (rect, sprite.image)
+        return state
+
+    def draw_dirty(self, screen, background):
+        '''Draw only the parts of the map that have changed since the last
+        draw_dirty() to the screen.
+
+        The background is either a Surface (drawn at the screen origin
+        behind the map) or a colour to fill behind the map.
+
+        Changes are the SpriteLayer sprites moving, changing image, being
+        added or being removed, anything passed to mark_dirty() and the
+        viewport moving. When the viewport moves over a colour background
+        the existing screen contents are scrolled and only the newly
+        exposed strips drawn; a Surface background doesn't scroll with the
+        map so everything must be redrawn.
+
+        Returns the list of screen Rects drawn to, to be passed to
+        pygame.display.update().
+        '''
+        view = Rect(self.view_x, self.view_y, self.view_w, self.view_h)
+        ox, oy = self.viewport.x - self.view_x, self.viewport.y - self.view_y
+        sprites = self._sprite_state()
+        last = self._drawn_viewport
+
+        full = last is None
+        dirty = []
+        if not full:
+            dx, dy = self.viewport.x - last[0], self.viewport.y - last[1]
+            if dx or dy:
+                if (isinstance(background, pygame.Surface) or
+                        abs(dx) >= view.width or abs(dy) >= view.height):
+                    full = True
+                else:
+                    # shift what's there and draw the exposed strips
+                    clip = screen.get_clip()
+                    screen.set_clip(view)
+                    screen.scroll(-dx, -dy)
+                    screen.set_clip(clip)
+                    if dx > 0:
+                        dirty.append(Rect(view.right - dx, view.top, dx,
+                            view.height))
+                    elif dx < 0:
+                        dirty.append(Rect(view.left, view.top, -dx,
+                            view.height))
+                    if dy > 0:
+                        dirty.append(Rect(view.left, view.bottom - dy,
+                            view.width, dy))
+                    elif dy < 0:
+                        dirty.append(Rect(view.left, view.top, view.width,
+                            -dy))
+
+        if full:
+            dirty = [view]
+        else:
+            # sprites that have moved or changed image, plus removed and
+            # added sprites, in map space
+            changed = list(self._dirty_rects)
+            for sprite, (rect, image) in self._drawn_sprites.items():
+                if sprites.get(sprite) != (rect, image):
+                    changed.append(rect)
+            for sprite, (rect, image) in sprites.items():
+                if self._drawn_sprites.get(sprite) != (rect, image):
+                    changed.append(rect)
+            for rect in changed:
+                rect = rect.move(-ox, -oy).clip(view)
+                if rect.width and rect.height:
+                    dirty.append(rect)
+            dirty = _merge_rects(dirty)
+
+        clip = screen.get_clip()
+        for rect in dirty:
+            screen.set_clip(rect)
+            if isinstance(background, pygame.Surface):
+                screen.blit(background, rect, rect)
+            else:
+                screen.fill(background, rect)
+            self.draw(screen)
+        screen.set_clip(clip)
+
+        self._drawn_viewport = self.viewport.topleft
+        self._drawn_sprites = sprites
+        self._dirty_rects = []
+        if last is None or last != self._drawn_viewport:
+            # the whole view has changed
+            return [view]
+        return dirty
+
     @classmethod
-    def load(cls, filename, viewport):
-        with open(filename) as f:
-            map = ElementTree.fromstring(f.read())
+    def load(cls, filename, viewport, chunk_size=None, cache=False):
+        '''Load a TMX file, parsing it incrementally so each top-level
+        element is discarded once it's been handled.
+
+        If cache is true the compiled version of the map is used instead,
+        compiling it first if it's missing or out of date (see compile().)
+        Note that this writes the compiled file next to the TMX file.
+        '''
+        if cache:
+            compiled = compiled_filename(filename)
+            try:
+                if not is_compiled(filename):
+                    compile(filename)
+                return cls.load_compiled(compiled, viewport, chunk_size)
+            except (IOError, OSError, EOFError, ValueError, struct.error):
+                # can't write or read the compiled map; use the TMX
+                pass
 
-        # get most general map informations and create a surface
         tilemap = TileMap(viewport)
-        tilemap.width = int(map.attrib['width'])
-        tilemap.height  = int(map.attrib['height'])
-        tilemap.tile_width = int(map.attrib['tilewidth'])
-        tilemap.tile_height = int(map.attrib['tileheight'])
+
+        # object layers are added after all the tile layers
+        object_layers = []
+
+        depth = 0
+        for event, tag in ElementTree.iterparse(filename, ('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if tag.tag == 'map':
+                    # get most general map informations
+                    tilemap.width = int(tag.attrib['width'])
+                    tilemap.height  = int(tag.attrib['height'])
+                    tilemap.tile_width = int(tag.attrib['tilewidth'])
+                    tilemap.tile_height = int(tag.attrib['tileheight'])
+                    tilemap.px_width = tilemap.width * tilemap.tile_width
+                    tilemap.px_height = tilemap.height * tilemap.tile_height
+                continue
+
+            depth -= 1
+            if depth != 1:
+                # only handle the children of <map>
+                continue
+
+            if tag.tag == 'tileset':
+                tilemap.tilesets.add(Tileset.fromxml(tag))
+            elif tag.tag == 'layer':
+                layer = Layer.fromxml(tag, tilemap)
+                layer.chunk_size = chunk_size
+                tilemap.layers.add_named(layer, layer.name)
+            elif tag.tag == 'objectgroup':
+                object_layers.append(ObjectLayer.fromxml(tag, tilemap))
+            tag.clear()
+
+        for layer in object_layers:
+            tilemap.layers.add_named(layer, layer.name)
+
+        return tilemap
+
+    @classmethod
+    def load_compiled(cls, filename, viewport, chunk_size=None):
+        '''Load a map compiled by compile().
+
+        The file is memory-mapped and each layer's gids are only copied out
+        of it when the layer is first used.
+        '''
+        with open(filename, 'rb') as f:
+            info = _read_compiled_info(f)
+            offset = f.tell()
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        tilemap = TileMap(viewport)
+        tilemap.width, tilemap.height = info['size']
+        tilemap.tile_width, tilemap.tile_height = info['tile_size']
         tilemap.px_width = tilemap.width * tilemap.tile_width
         tilemap.px_height = tilemap.height * tilemap.tile_height
 
-        for tag in map.findall('tileset'):
-            tilemap.tilesets.add(Tileset.fromxml(tag))
-
-        for tag in map.findall('layer'):
-            layer = Layer.fromxml(tag, tilemap)
+        for ts in info['tilesets']:
+            source = ts['source']
+            tileset = None
+            if source is not None:
+                tileset = tileset_cache.get_tileset(source, ts['firstgid'])
+            if tileset is None:
+                tileset = Tileset(ts['name'], ts['tile_width'],
+                    ts['tile_height'], ts['firstgid'])
+                if ts['image'] is not None:
+                    tileset.add_image(ts['image'])
+                for id, properties in ts['tiles'].items():
+                    tileset.get_tile(tileset.firstgid + id).properties.update(
+                        properties)
+                if source is not None:
+                    tileset_cache.add_tileset(source, tileset)
+            tilemap.tilesets.add(tileset)
+
+        size = tilemap.width * tilemap.height * 4
+        for name, visible in info['layers']:
+            layer = Layer(name, visible, tilemap)
+            layer.chunk_size = chunk_size
+            layer._payload = buffer(data, offset, size)
+            offset += size
             tilemap.layers.add_named(layer, layer.name)
 
-        for tag in map.findall('objectgroup'):
-            layer = ObjectLayer.fromxml(tag, tilemap)
+        for og in info['objectgroups']:
+            layer = ObjectLayer(og['name'], og['color'], [], og['opacity'],
+                og['visible'])
+            layer.properties.update(og['properties'])
+            for o in og['objects']:
+                tile = tilemap.tilesets[o['gid']] if o['gid'] else None
+                object = Object(o['type'], o['x'], o['y'], o['width'],
+                    o['height'], o['name'], o['gid'], tile, o['visible'])
+                object.properties.update(o['properties'])
+                layer.add_object(object)
             tilemap.layers.add_named(layer, layer.name)
 
         return tilemap
@@ -831,8 +1716,192 @@ class TileMap(object):
         sx, sy = self.pixel_from_screen(x, y)
         return int(sx//self.tile_width), int(sy//self.tile_height)
 
-def load(filename, viewport):
-    return TileMap.load(filename, viewport)
+def load(filename, viewport, chunk_size=None, cache=False):
+    '''Load a TMX file into a TileMap with the given viewport size.
+
+    If chunk_size is given the tile layers are drawn using pre-rendered
+    chunks of chunk_size x chunk_size cells (see Layer).
+
+    If cache is true the map is loaded from its compiled version (see
+    compile()), which is written next to the TMX file (with a "c" on the
+    end of the name) if it's missing or out of date.
+    '''
+    return TileMap.load(filename, viewport, chunk_size, cache)
+
+
+#
+# Compiled maps are a binary sidecar file next to the TMX file holding the
+# map, tileset and object information (marshalled) followed by the raw gids
+# of each layer. They're keyed by the modification time and MD5 hash of the
+# TMX file and any external tilesets it uses.
+#
+COMPILED_MAGIC = 'TMXC'
+COMPILED_VERSION = 2
+COMPILED_HEADER = struct.Struct('<4sII')
+
+
+def compiled_filename(filename):
+    '''Return the name of the compiled sidecar file for a TMX file.
+    '''
+    return filename + 'c'
+
+
+def _properties(tag):
+    # read the <property> children of the tag into a dict
+    properties = {}
+    for c in tag.findall('property'):
+        value = c.attrib['value']
+        # TODO hax
+        if value.isdigit():
+            value = int(value)
+        properties[c.attrib['name']] = value
+    return properties
+
+
+def _file_key(filename):
+    # the modification time and hash identifying a version of the file
+    with open(filename, 'rb') as f:
+        md5 = hashlib.md5(f.read()).hexdigest()
+    return os.path.getmtime(filename), md5
+
+
+def _read_compiled_info(f):
+    # read the header and info from an open compiled map file, leaving the
+    # file positioned at the start of the layer data
+    header = f.read(COMPILED_HEADER.size)
+    magic, version, length = COMPILED_HEADER.unpack(header)
+    if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+        raise ValueError('not a compiled map (version %d)' % COMPILED_VERSION)
+    return marshal.loads(f.read(length))
+
+
+def is_compiled(filename):
+    '''Determine whether the TMX file has an up-to-date compiled version.
+    '''
+    compiled = compiled_filename(filename)
+    try:
+        with open(compiled, 'rb') as f:
+            info = _read_compiled_info(f)
+    except (IOError, EOFError, ValueError, struct.error):
+        return False
+    touched = False
+    for source, (mtime, md5) in info['sources'].items():
+        try:
+            current = os.path.getmtime(source)
+            if current == mtime:
+                continue
+            if _file_key(source)[1] != md5:
+                return False
+        except (IOError, OSError):
+            return False
+        # the file's been touched but not changed; remember the new time so
+        # it's not hashed again on every load
+        info['sources'][source] = (current, md5)
+        touched = True
+    if touched:
+        try:
+            with open(compiled, 'rb') as f:
+                _read_compiled_info(f)
+                layer_data = f.read()
+            _write_compiled(compiled, info, [layer_data])
+        except (IOError, OSError):
+            # it's still up to date, we'll just check the hash again
+            pass
+    return True
+
+
+def _write_compiled(compiled, info, layer_data):
+    # write the info and layer data to the compiled map file, replacing it
+    # in one go so a reader never sees half a file
+    info = marshal.dumps(info)
+    with open(compiled + '.new', 'wb') as f:
+        f.write(COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION,
+            len(info)))
+        f.write(info)
+        for data in layer_data:
+            f.write(data)
+    # oh, Windows :-(
+    if sys.platform == 'win32' and os.path.exists(compiled):
+        os.remove(compiled)
+    os.rename(compiled + '.new', compiled)
+
+
+def compile(filename):
+    '''Compile the TMX file into its binary sidecar file.
+
+    This doesn't need pygame to be initialised so it may be done as part of
+    a build step. tmx.load(..., cache=True) will otherwise compile maps as
+    they're loaded.
+    '''
+    sources = {filename: _file_key(filename)}
+    info = dict(tilesets=[], layers=[], objectgroups=[], sources=sources)
+    layer_data = []
+
+    depth = 0
+    for event, tag in ElementTree.iterparse(filename, ('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if tag.tag == 'map':
+                info['size'] = (int(tag.attrib['width']),
+                    int(tag.attrib['height']))
+                info['tile_size'] = (int(tag.attrib['tilewidth']),
+                    int(tag.attrib['tileheight']))
+            continue
+
+        depth -= 1
+        if depth != 1:
+            continue
+
+        if tag.tag == 'tileset':
+            firstgid = int(tag.attrib['firstgid'])
+            source = tag.attrib.get('source')
+            if source is not None:
+                sources[source] = _file_key(source)
+                tag = ElementTree.parse(source).getroot()
+            image = tag.find('image')
+            tiles = {}
+            for c in tag.findall('tile'):
+                props = c.find('properties')
+                if props is not None:
+                    tiles[int(c.attrib['id'])] = _properties(props)
+            info['tilesets'].append(dict(name=tag.attrib['name'],
+                tile_width=int(tag.attrib['tilewidth']),
+                tile_height=int(tag.attrib['tileheight']),
+                firstgid=firstgid, tiles=tiles, source=source,
+                image=image.attrib['source'] if image is not None else None))
+        elif tag.tag == 'layer':
+            name = tag.attrib['name']
+            data = tag.find('data')
+            if data is None:
+                raise ValueError('layer %s does not contain <data>' % name)
+            # the decoded data is the little-endian gids
+            data = data.text.strip().decode('base64').decode('zlib')
+            width, height = info['size']
+            if len(data) != width * height * 4:
+                raise ValueError('layer %s has %d cells, expected %d' % (
+                    name, len(data) // 4, width * height))
+            layer_data.append(data)
+            info['layers'].append((name, int(tag.attrib.get('visible', 1))))
+        elif tag.tag == 'objectgroup':
+            objects = []
+            for o in tag.findall('object'):
+                props = o.find('properties')
+                objects.append(dict(type=o.attrib.get('type', 'rect'),
+                    x=int(o.attrib['x']), y=int(o.attrib['y']),
+                    width=int(o.attrib.get('width', 0)),
+                    height=int(o.attrib.get('height', 0)),
+                    name=o.attrib.get('name'),
+                    gid=int(o.attrib['gid']) if 'gid' in o.attrib else None,
+                    visible=int(o.attrib.get('visible', 1)),
+                    properties=_properties(props) if props is not None else {}))
+            info['objectgroups'].append(dict(name=tag.attrib['name'],
+                color=tag.attrib.get('color'),
+                opacity=float(tag.attrib.get('opacity', 1)),
+                visible=int(tag.attrib.get('visible', 1)),
+                properties=_properties(tag), objects=objects))
+        tag.clear()
+
+    _write_compiled(compiled_filename(filename), info, layer_data)
 
 if __name__ == '__main__':
     # allow image load to work
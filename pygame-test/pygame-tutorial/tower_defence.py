@@ -1,10 +1,19 @@
+import sys
 import math
 import random
 import cocos
 import pyglet
+from cocos.batch import BatchNode
 from cocos.director import director
 from cocos.tiles import Tile, RectCell, RectMapLayer
 
+from pool import Pool
+from flowfield import FlowField
+from spatial import SpatialGrid
+from tower_sim import (COLUMNS, ROWS, CELL_SIZE, CREEP_HEALTH, CREEP_INTERVAL,
+    GUN_COOLDOWN, tile_kind, stress_towers, move_creep, can_build,
+    fire_bullet, move_bullet, find_targets, aim_point, hit_creeps)
+
 pyglet.resource.path.append('data')
 pyglet.resource.reindex()
 
@@ -14,24 +23,24 @@ blank = pyglet.image.SolidColorImagePattern((200, 200, 200, 255)).create_image(1
 select = pyglet.image.SolidColorImagePattern((0, 255, 0, 128)).create_image(16, 16)
 invalid = pyglet.image.SolidColorImagePattern((255, 0, 0, 128)).create_image(16, 16)
 
+# the sprite images; pyglet.resource packs small images like these into one
+# texture atlas so all of the sprites share a single texture
+tower_image = pyglet.resource.image('tower.png')
+creep_image = pyglet.resource.image('creep.png')
+bullet_image = pyglet.resource.image('bullet.png')
+
 # now make up my tile types for mapping
 wall = Tile('wall', {'blocks': True}, wall)
 floor = Tile('floor', {}, blank)
 entrance = Tile('entrance', {'entrance': True}, blank)
 exit = Tile('exit', {'exit': True}, blank)
-tower = Tile('tower', {'blocks': True, 'tower': True}, pyglet.resource.image('tower.png'))
+tower = Tile('tower', {'blocks': True, 'tower': True}, tower_image)
 
 # size of the game window (30x20 16-pixel cells)
-WIDTH, HEIGHT = (30*16, 20*16)
+WIDTH, HEIGHT = (COLUMNS*CELL_SIZE, ROWS*CELL_SIZE)
 
-def distance(ax, ay, bx, by):
-    '''Determine the distance between two points.'''
-    return math.sqrt((ax-bx)**2 + (ay-by)**2)
-
-def collide(a, b):
-    '''Determine whether two objects with a center point and width
-    (diameter) are colliding.'''
-    return distance(a.x, a.y, b.x, b.y) < (a.width/2 + b.width/2)
+# run with --stress to fill the field with towers and creeps
+STRESS = '--stress' in sys.argv
 
 def heading(ax, ay, bx, by):
     '''Determin the heading, in degrees, from point a to b.'''
@@ -45,66 +54,46 @@ class MoveCreep(cocos.actions.Action):
     to move it to that cell at 50 pixels per second.
     '''
     def step(self, dt):
-        creep = self.target
-
-        # the target cell may be None (the creep has just reached the exit)
-        # or it may have been turned into a blocker (a tower was built)
-        if not creep.target or creep.target.get('blocks'):
-            # ask for a new target cell from the map
-            creep.target = creep.map.next_move(creep.cell)
-            if not creep.target:
-                # the creep is at the exit
-                creep.kill()
-                return
-
-        # figure distance to the target
-        # the creep's anchor is centered so we line that up with the center
-        # of the cell
-        tx, ty = creep.target.center
-        px, py = creep.position
-        d = distance(px, py, tx, ty)
-
-        # figure the distance moved this step (50 pixels per second)
-        move = 50*dt
-
-        if d <= move:
-            # the creep's move takes it to the destination so clean
-            # things up and ask for a new target from the map
-            creep.position = creep.target.center
-            creep.cell = creep.target
-            creep.target = creep.map.next_move(creep.cell)
-        else:
-            # move the 50 pixels per second along the line from the current
-            # position to the target
-            n = move / d
-            px += n * (tx - px)
-            py += n * (ty - py)
-            creep.position = (px, py)
+        # the rules of movement are shared with the simulation in tower_sim
+        if not move_creep(self.target, dt):
+            # the creep is at the exit
+            self.target.map.remove_creep(self.target)
 
 
 class Shoot(cocos.actions.Action):
     '''Have a turret aim at a creep and shoot.
     '''
     def init(self, creep):
-        # this is the creep to aim at
+        # this is the creep to aim at; creeps are reused once they're gone
+        # so remember which life of the creep this is
         self.creep = creep
+        self.generation = creep.generation
     def step(self, dt):
+        if self.creep.generation != self.generation:
+            # the creep died (or got out) and may already be back in play
+            # as a new creep; don't follow it
+            self._done = True
+            return
+
         # figure the angle to the creep and adjust the turret rotation to
         # that angle
         # TODO: adjust slowly
         angle = heading(*(self.target.position + self.creep.position))
         self.target.rotation = angle
 
-        if distance(*(self.creep.position + self.target.position)) > 50:
-            # the creep is too far away; cancel this action to allow the
-            # turret to re-aim
+        # the rules of when to shoot are shared with the simulation in
+        # tower_sim
+        target = aim_point(self.target, self.creep)
+        if target is None:
+            # the creep is too far away (or gone); cancel this action to
+            # allow the turret to re-aim
             self._done = True
+            return
 
-        if angle == self.target.rotation and self.creep.target:
+        if angle == self.target.rotation:
             # we're pointing at the creep so shoot at it
-            director.scene.shoot(self.target.position,
-                self.creep.target.center)
-            self.target.gun_cooldown = 1.5
+            director.scene.shoot(self.target.position, target)
+            self.target.gun_cooldown = GUN_COOLDOWN
             self._done = True
 
     def __deepcopy__(self, foo):
@@ -122,28 +111,35 @@ class Field(RectMapLayer):
     '''
     is_event_handler = True
 
-    def __init__(self):
+    def __init__(self, seed=None):
+        # the creeps' choice of entrance comes from here, so seeding it
+        # makes a game repeatable
+        self.random = random.Random(seed)
         cells = []
         self.entrances = []
+        blocked = []
+        exits = []
         # create a basic field with an entrance on one side and exit on the
         # other
-        for i in range(30):
+        tiles = dict(entrance=entrance, exit=exit, wall=wall, floor=floor)
+        for i in range(COLUMNS):
             column = []
-            for j in range(20):
-                if i == 0 and 7 < j < 12:
-                    tile = entrance
-                elif i == 29 and 7 < j < 12:
-                    tile = exit
-                elif i in (0, 29) or j in (0, 19):
-                    tile = wall
-                else:
-                    tile = floor
-                cell = RectCell(i, j, 16, 16, {}, tile)
+            for j in range(ROWS):
+                tile = tiles[tile_kind(i, j)]
+                cell = RectCell(i, j, CELL_SIZE, CELL_SIZE, {}, tile)
                 column.append(cell)
                 if tile is entrance:
                     self.entrances.append(cell)
+                elif tile is exit:
+                    exits.append((i, j))
+                elif tile is wall:
+                    blocked.append((i, j))
             cells.append(column)
-        super(Field, self).__init__('map', 16, 16, cells)
+        super(Field, self).__init__('map', CELL_SIZE, CELL_SIZE, cells)
+
+        # the way to the exit from every cell, shared by all the creeps
+        self.flow = FlowField(COLUMNS, ROWS, blocked, exits,
+            [(cell.i, cell.j) for cell in self.entrances])
 
         # center the field on the display
         self.origin_x = WIDTH//2 - self.px_width//2
@@ -152,33 +148,56 @@ class Field(RectMapLayer):
 
         # set up creep generation in 1 second
         self.next_creep = 1
+        self.creep_interval = CREEP_INTERVAL
+
+        # the creeps are put in a grid each frame so the towers and bullets
+        # only have to look at the creeps near them
+        self.creep_grid = SpatialGrid(CELL_SIZE)
 
         # register the gameplay update function to be called every frame
         self.schedule(self.update)
 
+        # the towers, bullets and creeps each go in a BatchNode rather than
+        # a plain Layer, so each lot is drawn all at once (rather than each
+        # sprite separately) no matter how many there are
+
         # a layer to manage the towers
-        self.towers = cocos.layer.Layer()
+        self.towers = BatchNode()
         self.add(self.towers)
 
         # a layer to manage the bullets
-        self.bullets = cocos.layer.Layer()
+        self.bullets = BatchNode()
         self.add(self.bullets)
 
         # a layer to manage the creeps
-        self.creeps = cocos.layer.Layer()
+        self.creeps = BatchNode()
         self.add(self.creeps)
 
+        # bullets and creeps come and go all the time so rather than making
+        # new sprites for each one we keep the old ones to use again
+        self.bullet_pool = Pool(lambda: cocos.sprite.Sprite(bullet_image), 32)
+        self.creep_pool = Pool(self.make_creep, 16)
+
         # a layer to give user feedback on tower placement
         self.select = cocos.sprite.Sprite(select)
         self.add(self.select)
         self.select.visible = False
 
+        if STRESS:
+            # towers on every other cell (leaving paths between them) and a
+            # steady stream of creeps
+            for i, j in stress_towers():
+                self.build_tower(self.cells[i][j])
+            self.creep_interval = .02
+
     def on_mouse_motion(self, x, y, dx, dy):
         # figure the cell the player has the mouse over and give visual
         # feedback on its suitability for building a tower
         cell = self.get_at_pixel(x, y)
         if cell:
-            if cell.get('blocks'):
+            # (this is just a look up in the flow field, so it's fine to do
+            # as the mouse moves)
+            if not can_build(cell, self.flow):
                 self.select.image = invalid
             else:
                 self.select.image = select
@@ -190,15 +209,26 @@ class Field(RectMapLayer):
             self.select.visible = False
 
     def on_mouse_release(self, x, y, button, modifiers):
-        # the player has clicked the mouse - build a tower
+        # the player has clicked the mouse - build a tower, as long as the
+        # creeps (including those already on their way) can still get to
+        # the exit
         cell = self.get_at_pixel(x, y)
-        tower = cocos.sprite.Sprite('tower.png', cell.center)
+        if not cell:
+            return
+        creeps = [(creep.cell.i, creep.cell.j)
+            for z, creep in self.creeps.children]
+        if can_build(cell, self.flow, creeps):
+            self.build_tower(cell)
+
+    def build_tower(self, cell):
+        tower = cocos.sprite.Sprite(tower_image, cell.center)
         tower.cell = cell
         tower.gun_cooldown = 0
         self.towers.add(tower)
         # make sure the player can't build here again (and that creeps
         # can't traverse this cell)
         cell['blocks'] = True
+        self.flow.block(cell.i, cell.j)
 
     def update(self, dt):
         '''Update the field.
@@ -210,63 +240,71 @@ class Field(RectMapLayer):
         self.next_creep -= dt
         if self.next_creep < 0:
             # send in a creep!
-            self.next_creep = 5
-            c = cocos.sprite.Sprite('creep.png')
-            c.cell = random.choice(self.entrances)
+            self.next_creep = self.creep_interval
+            c = self.creep_pool.acquire()
+            c.cell = self.random.choice(self.entrances)
             c.position = c.cell.center
             c.map = self
-            c.health = 2
+            c.health = CREEP_HEALTH
             c.target = None
             self.creeps.add(c)
             c.do(MoveCreep(self))
 
+        # sort the creeps into the grid
+        grid = self.creep_grid
+        grid.clear()
+        creep_radius = 0
+        for z, creep in self.creeps.children:
+            grid.add(creep, creep.x, creep.y)
+            creep_radius = max(creep_radius, creep.width/2)
+
         # see if any of the towers should shoot
         for z, tower in self.towers.children:
-            if tower.gun_cooldown:
-                tower.gun_cooldown = max(0, tower.gun_cooldown - dt)
-            elif not tower.actions:
-                for z, creep in self.creeps.children:
-                    if distance(*(creep.position + tower.position)) < 50:
-                        tower.do(Shoot(creep))
-
-        # see if any of the bullets have hit a creep
-        for z, bullet in self.bullets.children:
-            for z, creep in self.creeps.children:
-                if collide(bullet, creep):
-                    creep.health -= 1
-                    if creep.health <= 0:
-                        creep.kill()
-                    bullet.kill()
+            for creep in find_targets(tower, grid, dt, bool(tower.actions)):
+                tower.do(Shoot(creep))
+
+        # see if any of the bullets have hit a creep, and move the rest on
+        for z, bullet in list(self.bullets.children):
+            hit, killed = hit_creeps(bullet, grid, creep_radius)
+            for creep in killed:
+                self.remove_creep(creep)
+            if hit or not move_bullet(bullet, dt):
+                self.remove_bullet(bullet)
+
+    def make_creep(self):
+        creep = cocos.sprite.Sprite(creep_image)
+        # bumped each time the creep goes back in the pool so anything
+        # still holding on to it can tell it's gone
+        creep.generation = 0
+        return creep
+
+    def remove_creep(self, creep):
+        # stop it moving and put it back in the pool; any tower still aiming
+        # at it will notice the new generation and give up
+        creep.stop()
+        creep.kill()
+        creep.target = None
+        creep.generation += 1
+        self.creep_pool.release(creep)
+
+    def remove_bullet(self, bullet):
+        bullet.kill()
+        self.bullet_pool.release(bullet)
 
     def next_move(self, start):
         '''Determine the next move for a creep from the start position to
-        get to the exit.
+        get to the exit, or None if it's at the exit.
 
         Raises ValueError if the map is not solvable.
 
-        This implements a standard non-recursive flood fill until we hit
-        our target condition (determining the move cost for the start
-        cell).
+        This just looks up the next cell in the flow field, which already
+        knows the way to the exit from every cell.
         '''
-        cost = {}
-        for column in self.cells:
-            for cell in column:
-                if cell.get('exit'):
-                    cost[cell.i, cell.j] = 0
-        while True:
-            changed = False
-            for here in list(cost):
-                i, j = here
-                for attempt in (i, j+1), (i, j-1), (i-1, j), (i+1, j):
-                    if attempt in cost: continue
-                    cell = self.get_cell(*attempt)
-                    if cell is not None and not cell.get('blocks'):
-                        cost[attempt] = cost[here] + 1
-                        changed = True
-                    if cell is start:
-                        return self.get_cell(*here)
-            if not changed:
-                raise ValueError("Can't solve map")
+        move = self.flow.next_cell(start.i, start.j)
+        if move is None:
+            return None
+        i, j = move
+        return self.cells[i][j]
 
 class CreepsGame(cocos.scene.Scene):
     '''This scene manages a single game.
@@ -283,18 +321,15 @@ class CreepsGame(cocos.scene.Scene):
         # shoot at a creep; we implement this method here so it is easy to
         # access (on the scene) and so it has easy access to the scene
         # parts
-        x, y = start
-        tx, ty = target
-        bullet = cocos.sprite.Sprite('bullet.png', start)
-        dx, dy = tx-x, ty-y
-        d = math.sqrt(dx**2 +  dy**2)
-        x += dx * 50/d
-        y += dy * 50/d
-        bullet.do(cocos.actions.MoveTo((x+dx, y+dy), .5) +
-            cocos.actions.CallFunc(bullet.kill))
+        # the field moves the bullet along each update (rather than it
+        # being given new actions for every shot)
+        bullet = self.field.bullet_pool.acquire()
+        fire_bullet(bullet, start, target)
         self.field.bullets.add(bullet)
 
 
-# no scaling so our tile mapping isn't affected
-director.init(width=WIDTH, height=HEIGHT, do_not_scale=True)
-director.run(CreepsGame())
+if __name__ == '__main__':
+    # no scaling so our tile mapping isn't affected
+    director.init(width=WIDTH, height=HEIGHT, do_not_scale=True)
+    director.show_FPS = STRESS
+    director.run(CreepsGame())
@@ -0,0 +1,465 @@
+'''Play tower defence without a screen.
+
+The rules of tower_defence.py (the creeps coming in at the entrances and
+finding their way to the exit, the towers shooting at creeps in range and
+the bullets hitting them) live here, free of cocos, so they may be shared by
+the game and by a Simulation which plays them out with fixed time steps and
+its own seedable random number generator.
+
+Running this module sends waves of creeps across a field of towers much
+faster than real time and reports how it went, which is useful for testing
+the balance of the game (and how it performs with lots going on):
+
+    python tower_sim.py [--waves N] [--wave-size N] [--interval S]
+        [--towers N | --stress] [--dt S] [--seed N] [-o FILE]
+'''
+import json
+import math
+import time
+import random
+import argparse
+
+from flowfield import FlowField
+from spatial import SpatialGrid
+
+# the field is 30x20 16-pixel cells
+COLUMNS, ROWS = 30, 20
+CELL_SIZE = 16
+
+CREEP_SPEED = 50        # pixels per second
+CREEP_HEALTH = 2
+CREEP_INTERVAL = 5      # seconds between creeps
+TOWER_RANGE = 50        # how close (in pixels) a creep must be to shoot at
+GUN_COOLDOWN = 1.5      # seconds between shots
+BULLET_RANGE = 50       # how far past its target a bullet flies
+BULLET_TIME = .5        # seconds a bullet is in flight
+
+# the sizes of the images
+CREEP_WIDTH = 16
+BULLET_WIDTH = 4
+
+
+def tile_kind(i, j):
+    '''Return the kind of tile at cell (i, j) of the field: an entrance on
+    one side, an exit on the other and walls around the rest.
+    '''
+    if i == 0 and 7 < j < 12:
+        return 'entrance'
+    elif i == COLUMNS-1 and 7 < j < 12:
+        return 'exit'
+    elif i in (0, COLUMNS-1) or j in (0, ROWS-1):
+        return 'wall'
+    return 'floor'
+
+def stress_towers():
+    '''Return tower cells filling every other cell of the field, leaving
+    paths between them.'''
+    return [(i, j) for i in range(2, COLUMNS-2, 2) for j in range(2, ROWS-2, 2)]
+
+def distance(ax, ay, bx, by):
+    '''Determine the distance between two points.'''
+    return math.sqrt((ax-bx)**2 + (ay-by)**2)
+
+def distance2(ax, ay, bx, by):
+    '''Determine the square of the distance between two points, which is
+    cheaper than the distance and fine for comparing distances.'''
+    return (ax-bx)**2 + (ay-by)**2
+
+def collide(a, b):
+    '''Determine whether two objects with a center point and width
+    (diameter) are colliding.'''
+    r = a.width/2 + b.width/2
+    return distance2(a.x, a.y, b.x, b.y) < r*r
+
+def move_creep(creep, dt):
+    '''Move the creep towards its target cell (called .target) at
+    CREEP_SPEED pixels per second, picking a new target from the map as it
+    arrives at each one.
+
+    Returns False if the creep has reached the exit.
+    '''
+    # the target cell may be None (the creep has just reached the exit)
+    # or it may have been turned into a blocker (a tower was built)
+    if not creep.target or creep.target.get('blocks'):
+        # ask for a new target cell from the map
+        creep.target = creep.map.next_move(creep.cell)
+        if not creep.target:
+            # the creep is at the exit
+            return False
+
+    # figure distance to the target
+    # the creep's anchor is centered so we line that up with the center
+    # of the cell
+    tx, ty = creep.target.center
+    px, py = creep.position
+    d = distance(px, py, tx, ty)
+
+    # figure the distance moved this step
+    move = CREEP_SPEED*dt
+
+    if d <= move:
+        # the creep's move takes it to the destination so clean
+        # things up and ask for a new target from the map
+        creep.position = creep.target.center
+        creep.cell = creep.target
+        creep.target = creep.map.next_move(creep.cell)
+    else:
+        # move along the line from the current position to the target
+        n = move / d
+        px += n * (tx - px)
+        py += n * (ty - py)
+        creep.position = (px, py)
+    return True
+
+def can_build(cell, flow, others=()):
+    '''Could a tower go on the cell (of the map with the FlowField flow)
+    without cutting off the creeps' way to the exit from the entrances, or
+    from any of the other (i, j) cells?'''
+    if cell.get('blocks') or cell.get('entrance') or cell.get('exit'):
+        return False
+    return not flow.would_disconnect(cell.i, cell.j, others)
+
+def bullet_end(start, target):
+    '''Return where a bullet shot from start at target ends up: it flies
+    BULLET_RANGE pixels past the target.'''
+    x, y = start
+    tx, ty = target
+    dx, dy = tx-x, ty-y
+    d = math.sqrt(dx**2 + dy**2)
+    x += dx * BULLET_RANGE/d
+    y += dy * BULLET_RANGE/d
+    return (x+dx, y+dy)
+
+def fire_bullet(bullet, start, target):
+    '''Set the bullet off from start towards target.'''
+    bullet.position = bullet.start = start
+    bullet.end = bullet_end(start, target)
+    bullet.elapsed = 0
+
+def move_bullet(bullet, dt):
+    '''Move the bullet along its flight from .start to .end, which takes
+    BULLET_TIME seconds.
+
+    Returns False once the bullet has got to the end.
+    '''
+    bullet.elapsed += dt
+    t = min(1, bullet.elapsed / BULLET_TIME)
+    (sx, sy), (ex, ey) = bullet.start, bullet.end
+    bullet.position = (sx + (ex-sx)*t, sy + (ey-sy)*t)
+    return t < 1
+
+def find_targets(tower, grid, dt, busy=False):
+    '''Count down the tower's gun cooldown and, once it's ready to shoot
+    (and not busy aiming already), return the creeps in range of it from
+    the SpatialGrid grid.'''
+    if tower.gun_cooldown:
+        tower.gun_cooldown = max(0, tower.gun_cooldown - dt)
+        return []
+    if busy:
+        return []
+    return grid.near(tower.x, tower.y, TOWER_RANGE)
+
+def aim_point(tower, creep):
+    '''Return the point the tower should shoot at to hit the creep it's
+    aiming at (the cell the creep's heading for), or None if it shouldn't
+    shoot: the creep has been killed or got out (its .target is cleared
+    when it's removed) or it has moved out of range.'''
+    if not creep.target:
+        return None
+    if distance2(tower.x, tower.y, creep.x, creep.y) > TOWER_RANGE**2:
+        return None
+    return creep.target.center
+
+def hit_creeps(bullet, grid, creep_radius):
+    '''Damage the creeps from the SpatialGrid grid that the bullet is
+    touching.
+
+    Returns whether the bullet hit anything (and so is spent) and the list
+    of creeps it killed, which are for the caller to remove.
+    '''
+    hit = False
+    killed = []
+    for creep in grid.near(bullet.x, bullet.y,
+            bullet.width/2 + creep_radius):
+        if creep.health > 0 and collide(bullet, creep):
+            hit = True
+            creep.health -= 1
+            if creep.health <= 0:
+                killed.append(creep)
+    return hit, killed
+
+
+class Cell(dict):
+    '''A cell of the field (with the same i, j and center as a cocos
+    RectCell) holding its properties.'''
+    def __init__(self, i, j, properties):
+        super(Cell, self).__init__(properties)
+        self.i = i
+        self.j = j
+        self.center = (i*CELL_SIZE + CELL_SIZE//2, j*CELL_SIZE + CELL_SIZE//2)
+
+
+class Thing(object):
+    '''Something on the field with a position (like a cocos Sprite.)'''
+    width = 0
+
+    def __init__(self, position):
+        self.x, self.y = position
+
+    @property
+    def position(self):
+        return (self.x, self.y)
+
+    @position.setter
+    def position(self, position):
+        self.x, self.y = position
+
+
+class Creep(Thing):
+    width = CREEP_WIDTH
+
+
+class Bullet(Thing):
+    width = BULLET_WIDTH
+
+
+class Tower(Thing):
+    pass
+
+
+class Simulation(object):
+    def __init__(self, seed=None, creep_interval=CREEP_INTERVAL):
+        self.random = random.Random(seed)
+        self.creep_interval = creep_interval
+        self.cells = []
+        self.entrances = []
+        blocked = []
+        exits = []
+        for i in range(COLUMNS):
+            column = []
+            for j in range(ROWS):
+                kind = tile_kind(i, j)
+                cell = Cell(i, j, {kind: True})
+                if kind == 'wall':
+                    cell['blocks'] = True
+                    blocked.append((i, j))
+                elif kind == 'entrance':
+                    self.entrances.append(cell)
+                elif kind == 'exit':
+                    exits.append((i, j))
+                column.append(cell)
+            self.cells.append(column)
+        self.flow = FlowField(COLUMNS, ROWS, blocked, exits,
+            [(cell.i, cell.j) for cell in self.entrances])
+        self.creep_grid = SpatialGrid(CELL_SIZE)
+
+        self.creeps = []
+        self.towers = []
+        self.bullets = []
+        # creeps left to send in this wave and the time until the next one
+        self.to_send = 0
+        self.next_creep = 1
+
+        self.ticks = 0
+        self.time = 0
+        self.spawned = 0
+        self.leaked = 0
+        self.killed = 0
+        self.shots = 0
+        self.hits = 0
+
+    def build_tower(self, i, j):
+        cell = self.cells[i][j]
+        tower = Tower(cell.center)
+        tower.cell = cell
+        tower.gun_cooldown = 0
+        # the creeps it's about to shoot at
+        tower.aiming = []
+        self.towers.append(tower)
+        cell['blocks'] = True
+        self.flow.block(i, j)
+
+    def build_random_towers(self, count):
+        '''Build towers on count randomly chosen cells, keeping the field
+        solvable.'''
+        cells = [(i, j) for i in range(COLUMNS) for j in range(ROWS)
+            if tile_kind(i, j) == 'floor']
+        self.random.shuffle(cells)
+        built = 0
+        for i, j in cells:
+            if built == count:
+                break
+            if can_build(self.cells[i][j], self.flow):
+                self.build_tower(i, j)
+                built += 1
+        return built
+
+    def next_move(self, start):
+        '''Determine the next move for a creep from the start cell to get to
+        the exit, or None if it's at the exit.'''
+        move = self.flow.next_cell(start.i, start.j)
+        if move is None:
+            return None
+        i, j = move
+        return self.cells[i][j]
+
+    def send_wave(self, size):
+        self.to_send += size
+        self.next_creep = 1
+
+    def step(self, dt):
+        '''Move everything on by dt seconds, in the same order as the game:
+        the field's update and then the creeps', towers' and bullets'
+        actions.
+        '''
+        self.ticks += 1
+        self.time += dt
+        # the towers only shoot (and bullets only move) from the step after
+        # they start to
+        towers = [tower for tower in self.towers if tower.aiming]
+        bullets = list(self.bullets)
+        self.update(dt)
+
+        for creep in list(self.creeps):
+            if not move_creep(creep, dt):
+                self.creeps.remove(creep)
+                self.leaked += 1
+
+        for tower in towers:
+            for creep in tower.aiming:
+                # (the creep may have been killed, or moved away, while the
+                # tower turned)
+                target = aim_point(tower, creep)
+                if target:
+                    self.shoot(tower.position, target)
+                    tower.gun_cooldown = GUN_COOLDOWN
+            tower.aiming = []
+
+        for bullet in bullets:
+            if bullet.dead:
+                continue
+            if not move_bullet(bullet, dt):
+                self.kill_bullet(bullet)
+
+    def update(self, dt):
+        '''The game's Field.update: send in creeps, aim idle towers and
+        resolve bullet hits.'''
+        if self.to_send:
+            self.next_creep -= dt
+            if self.next_creep < 0:
+                self.next_creep = self.creep_interval
+                self.to_send -= 1
+                self.spawn()
+
+        grid = self.creep_grid
+        grid.clear()
+        for creep in self.creeps:
+            grid.add(creep, creep.x, creep.y)
+
+        for tower in self.towers:
+            # (a tower only aims once its gun has cooled down, so there's
+            # nothing to count down while it's aiming)
+            if not tower.aiming:
+                tower.aiming = find_targets(tower, grid, dt)
+
+        for bullet in list(self.bullets):
+            hit, killed = hit_creeps(bullet, grid, CREEP_WIDTH/2)
+            for creep in killed:
+                self.kill_creep(creep)
+            if hit:
+                self.hits += 1
+                self.kill_bullet(bullet)
+
+    def spawn(self):
+        cell = self.random.choice(self.entrances)
+        creep = Creep(cell.center)
+        creep.cell = cell
+        creep.map = self
+        creep.health = CREEP_HEALTH
+        creep.target = None
+        self.creeps.append(creep)
+        self.spawned += 1
+
+    def kill_creep(self, creep):
+        self.creeps.remove(creep)
+        # so any tower aiming at it knows it's gone
+        creep.target = None
+        self.killed += 1
+
+    def shoot(self, start, target):
+        bullet = Bullet(start)
+        fire_bullet(bullet, start, target)
+        bullet.dead = False
+        self.bullets.append(bullet)
+        self.shots += 1
+
+    def kill_bullet(self, bullet):
+        bullet.dead = True
+        self.bullets.remove(bullet)
+
+    def run_wave(self, size, dt):
+        '''Send in a wave of creeps and step until they've all been killed or
+        reached the exit.'''
+        self.send_wave(size)
+        while self.to_send or self.creeps or self.bullets:
+            self.step(dt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--waves', type=int, default=10)
+    parser.add_argument('--wave-size', type=int, default=20,
+        help='number of creeps in each wave')
+    parser.add_argument('--interval', type=float, default=CREEP_INTERVAL,
+        help='seconds between creeps in a wave')
+    parser.add_argument('--towers', type=int, default=20,
+        help='number of towers to build at random')
+    parser.add_argument('--stress', action='store_true',
+        help='fill the field with towers (as tower_defence.py --stress)')
+    parser.add_argument('--dt', type=float, default=1/60.,
+        help='seconds per step')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the JSON to this file')
+    args = parser.parse_args()
+
+    sim = Simulation(args.seed, args.interval)
+    if args.stress:
+        for i, j in stress_towers():
+            sim.build_tower(i, j)
+    else:
+        sim.build_random_towers(args.towers)
+
+    waves = []
+    start = time.time()
+    for n in range(args.waves):
+        leaked, killed = sim.leaked, sim.killed
+        sim.run_wave(args.wave_size, args.dt)
+        waves.append(dict(leaked=sim.leaked - leaked,
+            killed=sim.killed - killed))
+    elapsed = time.time() - start
+
+    results = json.dumps(dict(
+        seed=args.seed,
+        towers=len(sim.towers),
+        ticks=sim.ticks,
+        game_seconds=sim.time,
+        seconds=elapsed,
+        ticks_per_second=sim.ticks / elapsed,
+        speedup=sim.time / elapsed,
+        creeps=sim.spawned,
+        leaked=sim.leaked,
+        killed=sim.killed,
+        shots=sim.shots,
+        hits=sim.hits,
+        # how many of the shots fired hit something
+        tower_efficiency=sim.hits / float(sim.shots or 1),
+        waves=waves,
+    ), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        print results
+
+if __name__ == '__main__':
+    main()